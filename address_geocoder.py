@@ -10,92 +10,297 @@ import os
 import re
 import sys
 import time
+import socket
 import sqlite3
+import argparse
 # Third Party Library
 import geo
+from geo.address import canonical, parse_address
 # Dependent Module
 import settings
+from sample_index import SampleIndex
+from spatial_index import SpatialIndex
+from geocode_queue import init_queue, enqueue, claim, complete, release, pending, Heartbeat, LEASE
 
 IMPORTED_FOLDERS = "IMPORTED_FOLDERS"
+ADDRESS_KEY = "ADDRESS_KEY"
 COUNTY_PRI = ['A', 'B', 'D', 'E', 'F', 'H', 'C', 'G', 'I', 'J', 'K',\
               'M', 'N', 'O', 'P', 'Q', 'T', 'U', 'V', 'W', 'X', 'Z']
 
-# XXX: add input of sample rate
-def selective_geocode(rough_address: str) -> dict:
-    """ Gets the average GPS coordinates of the rough address interval """
-    lat_results = []; lon_results = []
+ADDRESS_BATCH = 200 # rough addresses whose samples are submitted together
+COMMIT_INTERVAL = 1000 # most rough addresses written per commit, which also precedes provider calls
+BUSY_TIMEOUT = 600 # seconds a worker waits for the write transaction of another
+POLL_INTERVAL = 30 # seconds an idle worker waits for leases of others to finish or expire
+RETRY_INTERVAL = 3600 # seconds a worker whose providers ran out waits before leasing again
+DEDUP_STATS = {"merged": 0, "saved": 0} # spelling variants folded into one address key
+SAMPLE_STATS = {"ranges": 0, "indexed": 0, "geocoded": 0} # where sample coordinates came from
+
+def number_range(rough_address: str) -> tuple:
+    """ Gets (text, lowest, highest) door number of the rough address interval """
     found = re.findall(r"\d+~\d+", rough_address)
     if not found:
         raise geo.AddressError(geo.__name__, rough_address)
     bound = [int(i) for i in found[0].split('~')]
     if bound[0] > bound[1]:
         raise geo.AddressError(geo.__name__, rough_address)
-    interval = int((bound[1] - bound[0] + 1) / settings.GEO_SAMPLES)
-    samples = [i for i in range(bound[0], bound[1] + 1, interval)]
-    for sample in samples:
-        query_address = rough_address.replace(found[0], str(sample))
-        gps_coordinates = geo.geocode(query_address, culture='zh-TW')["GPS"]
-        if gps_coordinates["lat"] and gps_coordinates["lon"]:
+    return (found[0], bound[0], bound[1])
+
+def sample_numbers(low: int, high: int, samples: int = settings.GEO_SAMPLES) -> list:
+    """ Lists at most samples door numbers evenly spaced from low on """
+    # intervals narrower than samples are sampled at every number
+    interval = max(1, (high - low + 1) // samples)
+    return list(range(low, high + 1, interval))[:samples]
+
+def sample_addresses(rough_address: str, samples: int = settings.GEO_SAMPLES) -> list:
+    """ Lists addresses sampled evenly from the rough address interval """
+    (text, low, high) = number_range(rough_address)
+    return [rough_address.replace(text, str(sample))
+            for sample in sample_numbers(low, high, samples)]
+
+def collect_samples(geocoded: list) -> dict:
+    """ Gathers GPS coordinates of samples found by geocoding """
+    lat_results = []; lon_results = []
+    for gps_coordinates in geocoded:
+        if gps_coordinates and gps_coordinates["lat"] and gps_coordinates["lon"]:
             lat_results.append(gps_coordinates["lat"])
             lon_results.append(gps_coordinates["lon"])
     return {"lat": lat_results, "lon": lon_results}
 
-def partition_geocode(con: sqlite3.Connection, cur: sqlite3.Cursor, quarter: str, county_cht: str):
-    """ Geocode address of the same county in quarter fashion """
-    cur.execute('''SELECT 土地區段位置或建物區門牌 FROM "{0}/TRX"
-                   WHERE 縣市 = ?
-                   GROUP BY 土地區段位置或建物區門牌;'''.format(quarter), (county_cht,))
-    for address, in cur.fetchall():
-        cur.execute('''SELECT GEO.編號
+def backfill_samples(cur: sqlite3.Cursor, index: SampleIndex):
+    """ Fill sample index with the samples of addresses geocoded before it existed """
+    cur.execute("SELECT quarter FROM {0};".format(IMPORTED_FOLDERS))
+    for (quarter,) in cur.fetchall():
+        cur.execute('''SELECT TRX.縣市, TRX.土地區段位置或建物區門牌,
+                              LAT_1, LON_1, LAT_2, LON_2, LAT_3, LON_3, LAT_4, LON_4, LAT_5, LON_5
                        FROM "{0}/TRX" AS TRX, "{0}/GEO" AS GEO
-                       WHERE TRX.編號 = GEO.編號
-                       AND TRX.土地區段位置或建物區門牌 = ?
-                       AND GEO.LAT_Avg ISNULL;'''.format(quarter), (address,))
-        identities = cur.fetchall()
-        if not identities:
+                       WHERE TRX.編號 = GEO.編號 AND GEO.LAT_Avg NOTNULL
+                       GROUP BY TRX.縣市, TRX.土地區段位置或建物區門牌;'''.format(quarter))
+        for (county_cht, address, *coordinates) in cur.fetchall():
+            points = [(lat, lon) for (lat, lon) in zip(coordinates[::2], coordinates[1::2]) if lat]
+            try:
+                queries = sample_addresses(canonical(address), len(points))
+            except geo.AddressError:
+                continue
+            # samples were taken in the same order, so they line up with the stored columns
+            for (query, (lat, lon)) in zip(queries, points):
+                index.add(query, county_cht, lat, lon)
+    index.flush()
+
+def partition_geocode(con: sqlite3.Connection, cur: sqlite3.Cursor, quarter: str, county_cht: str,
+                      samples: int = settings.GEO_SAMPLES, commit_interval: int = COMMIT_INTERVAL,
+                      keys: set = None):
+    """ Geocode address of the same county in quarter fashion, once per address key """
+    # one grouped query lists every address still missing coordinates with its 編號s
+    cur.execute('''SELECT TRX.土地區段位置或建物區門牌, ifnull(K.key, TRX.土地區段位置或建物區門牌),
+                          group_concat(GEO.編號, ',')
+                   FROM "{0}/TRX" AS TRX JOIN "{0}/GEO" AS GEO ON TRX.編號 = GEO.編號
+                   LEFT JOIN {1} AS K
+                   ON K.county = TRX.縣市 AND K.address = TRX.土地區段位置或建物區門牌
+                   WHERE TRX.縣市 = ? AND GEO.LAT_Avg ISNULL
+                   GROUP BY TRX.土地區段位置或建物區門牌;'''.format(quarter, ADDRESS_KEY),
+                (county_cht,))
+    variants = {}
+    for (address, key, identities) in cur.fetchall():
+        variants.setdefault(key, []).append((address, identities.split(",")))
+    pending = []
+    for (key, found) in variants.items():
+        # workers only geocode address keys they hold a lease on
+        if keys is not None and key not in keys:
             continue
-        print("[%d] "%(len(identities)) + address)
+        # canonical spelling has ASCII digits for sampling, and names its county for providers
+        # and the geocode cache, as districts such as 中正區 exist in more than one county
+        address = canonical(found[0][0])
+        parts = parse_address(address)
+        if parts and not parts.county:
+            address = county_cht + address
         try:
-            results = selective_geocode(address)
+            queries = sample_addresses(address, samples)
         except geo.AddressError:
             continue
-        if len(results["lat"]) != 5 or len(results["lon"]) != 5:
-            continue
-        results["lat"].append(sum(results["lat"]) / len(results["lat"]))
-        results["lon"].append(sum(results["lon"]) / len(results["lon"]))
-        combined = [num for zipped in zip(results["lat"], results["lon"]) for num in zipped]
-        values = [(tuple(combined) + identity) for identity in identities]
-        cur.executemany('''UPDATE "{0}/GEO" SET
-                               LAT_1 = ?, LON_1 = ?,
-                               LAT_2 = ?, LON_2 = ?,
-                               LAT_3 = ?, LON_3 = ?,
-                               LAT_4 = ?, LON_4 = ?,
-                               LAT_5 = ?, LON_5 = ?,
-                               LAT_Avg = ?, LON_Avg = ?
-                           WHERE 編號 = ?;'''.format(quarter), values)
+        # every other spelling would have cost the same queries again
+        DEDUP_STATS["merged"] += len(found) - 1
+        DEDUP_STATS["saved"] += (len(found) - 1) * len(queries)
+        identities = [(identity,) for (_, group) in found for identity in group]
+        pending.append((found[0][0], identities, queries))
+    index = SampleIndex(cur)
+    if index.created:
+        backfill_samples(cur, index)
+    uncommitted = 0
+    for start in range(0, len(pending), ADDRESS_BATCH):
+        batch = pending[start:start + ADDRESS_BATCH]
+        # samples near known door numbers of the same road are interpolated, the rest geocoded
+        located = {}; missing = []  # init local variable
+        for (_, _, queries) in batch:
+            for query in queries:
+                if query not in located:
+                    located[query] = index.lookup(query, county_cht)
+                    if not located[query]:
+                        missing.append(query)
+        SAMPLE_STATS["ranges"] += len(batch)
+        SAMPLE_STATS["indexed"] += len(located) - len(missing)
+        SAMPLE_STATS["geocoded"] += len(missing)
+        if missing and con.in_transaction:
+            # no write lock is held while providers answer, other writers get in between batches
+            index.flush()
+            con.commit()
+            uncommitted = 0
+        # samples of the whole batch are split among providers together
+        for (query, result) in zip(missing, geo.geocode_batch(missing, culture='zh-TW')):
+            located[query] = result["GPS"] if result else None
+            if result and result["GPS"]["lat"] and result["GPS"]["lon"]:
+                index.add(query, county_cht, result["GPS"]["lat"], result["GPS"]["lon"])
+        for (address, identities, queries) in batch:
+            print("[%d] "%(len(identities)) + address)
+            results = collect_samples([located[query] for query in queries])
+            if len(results["lat"]) != len(queries) or len(results["lon"]) != len(queries):
+                continue
+            # five columns hold the first samples, the average covers all of them
+            average = (sum(results["lat"]) / len(results["lat"]),
+                       sum(results["lon"]) / len(results["lon"]))
+            padding = [None] * (2 * settings.GEO_SAMPLES)
+            combined = ([num for zipped in zip(results["lat"], results["lon"]) for num in zipped]
+                        + padding)[:2 * settings.GEO_SAMPLES]
+            values = [(tuple(combined) + average + identity) for identity in identities]
+            cur.executemany('''UPDATE "{0}/GEO" SET
+                                   LAT_1 = ?, LON_1 = ?,
+                                   LAT_2 = ?, LON_2 = ?,
+                                   LAT_3 = ?, LON_3 = ?,
+                                   LAT_4 = ?, LON_4 = ?,
+                                   LAT_5 = ?, LON_5 = ?,
+                                   LAT_Avg = ?, LON_Avg = ?
+                               WHERE 編號 = ?;'''.format(quarter), values)
+            uncommitted += 1
+            # coordinates and their sample points commit together, rows still NULL resume on restart
+            if uncommitted >= commit_interval:
+                index.flush()
+                con.commit()
+                uncommitted = 0
+    index.flush()
+    con.commit()
+
+def pending_partitions(cur: sqlite3.Cursor) -> list:
+    """ List (quarter, county letter) partitions not yet geocoded, in county priority """
+    partitions = []
+    for prefix in COUNTY_PRI:
+        bitmask = 1 << (ord(prefix) - 65)
+        cur.execute('''SELECT quarter FROM {0}
+                       WHERE (geocode_log & ?) != ?'''.format(IMPORTED_FOLDERS),
+                    (bitmask, bitmask))
+        partitions.extend((result[0], prefix) for result in cur.fetchall())
+    return partitions
+
+def county_geocode(con: sqlite3.Connection, cur: sqlite3.Cursor, quarter: str, prefix: str,
+                   samples: int = settings.GEO_SAMPLES, commit_interval: int = COMMIT_INTERVAL):
+    """ Geocode a county of quarter and mark it done in geocode log """
+    county_cht = settings.alpha2cht(prefix)
+    bitmask = 1 << (ord(prefix) - 65)
+    print("\n%s %s" %(quarter, county_cht))
+    # triggers put coordinates written from here on into the spatial index
+    SpatialIndex(cur)
+    partition_geocode(con, cur, quarter, county_cht, samples, commit_interval)
+    cur.execute('''UPDATE {0} SET geocode_log = (geocode_log | ?)
+                   WHERE quarter = ?;'''.format(IMPORTED_FOLDERS),
+                (bitmask, quarter))
+    con.commit()
+
+def fill_queue(con: sqlite3.Connection, cur: sqlite3.Cursor) -> int:
+    """ Queue address ranges of partitions not yet handed to workers, return count """
+    init_queue(cur)
+    queued = 0
+    for (quarter, prefix) in pending_partitions(cur):
+        bitmask = 1 << (ord(prefix) - 65)
+        queued += enqueue(cur, quarter, settings.alpha2cht(prefix), COUNTY_PRI.index(prefix))
+        # with workers the geocode log marks partitions handed to the queue
+        cur.execute('''UPDATE {0} SET geocode_log = (geocode_log | ?)
+                       WHERE quarter = ?;'''.format(IMPORTED_FOLDERS), (bitmask, quarter))
         con.commit()
+    # triggers put coordinates written from here on into the spatial index
+    SpatialIndex(cur)
+    con.commit()
+    return queued
+
+def worker(name: str, samples: int = settings.GEO_SAMPLES,
+           commit_interval: int = COMMIT_INTERVAL, lease: float = LEASE):
+    """ Geocode address ranges leased from the queue, alongside workers holding other keys """
+    # write transactions take the lock up front, so workers queue for it instead of deadlocking
+    connection = sqlite3.connect(settings.__main_db__, timeout=BUSY_TIMEOUT,
+                                 isolation_level="IMMEDIATE")
+    cursor = connection.cursor()
+    heartbeat = Heartbeat(settings.__main_db__, name, lease, BUSY_TIMEOUT)
+    heartbeat.start()
+    county_cht = None
+    try:
+        while True:
+            fill_queue(connection, cursor)
+            leased = claim(connection, cursor, name, lease=lease, county=county_cht)
+            if not leased:
+                (free, held) = pending(cursor)
+                if not free and not held:
+                    break
+                # address ranges of a worker that died come back once its leases expire
+                time.sleep(min(POLL_INTERVAL, lease / 3))
+                continue
+            # a lease holds address ranges of one quarter and county
+            (quarter, county_cht) = leased[0][1:3]
+            print("\n%s %s [%s]" %(quarter, county_cht, name))
+            try:
+                partition_geocode(connection, cursor, quarter, county_cht, samples,
+                                  commit_interval, set(row[3] for row in leased))
+                complete(cursor, name, [row[0] for row in leased])
+                connection.commit()
+            except geo.TryAgainLater:
+                # coordinates found so far are kept, the rest is left to workers with quota
+                connection.commit()
+                release(cursor, name, [row[0] for row in leased])
+                connection.commit()
+                print("\nProviders of %s unavailable, leasing again in %d seconds"
+                      %(name, RETRY_INTERVAL), file=sys.stderr)
+                time.sleep(RETRY_INTERVAL)
+    finally:
+        heartbeat.stop()
+        connection.close()
+        print_cache_stats()
+
+def print_cache_stats():
+    """ Report how many geocode queries were answered from cache """
+    stats = geo.CACHE.stats()
+    print("\nCache: %d hits, %d misses (%.0f%% hit rate), %d entries"
+          %(stats["hits"], stats["misses"], stats["hit_rate"] * 100, stats["entries"]))
+    print("Address keys: %d variants merged, %d geocode queries saved"
+          %(DEDUP_STATS["merged"], DEDUP_STATS["saved"]))
+    if SAMPLE_STATS["ranges"]:
+        print("Samples: %d from sample index, %d geocoded (%.2f calls per address range)"
+              %(SAMPLE_STATS["indexed"], SAMPLE_STATS["geocoded"],
+                SAMPLE_STATS["geocoded"] / SAMPLE_STATS["ranges"]))
 
-def main():
+def main(samples: int = settings.GEO_SAMPLES, commit_interval: int = COMMIT_INTERVAL):
     """ Main Process """
     connection = sqlite3.connect(settings.__main_db__)
     cursor = connection.cursor()
-    for prefix in COUNTY_PRI:
-        county_cht = settings.alpha2cht(prefix)
-        bitmask = 1 << (ord(prefix) - 65)
-        cursor.execute('''SELECT quarter FROM {0}
-                          WHERE (geocode_log & ?) != ?'''.format(IMPORTED_FOLDERS),
-                       (bitmask, bitmask))
-        quarters = [result[0] for result in cursor.fetchall()]
-        for quarter in quarters:
-            print("\n%s %s" %(quarter, county_cht))
-            partition_geocode(connection, cursor, quarter, county_cht)
-            cursor.execute('''UPDATE {0} SET geocode_log = (geocode_log | ?)
-                              WHERE quarter = ?;'''.format(IMPORTED_FOLDERS),
-                           (bitmask, quarter))
-            connection.commit()
+    for (quarter, prefix) in pending_partitions(cursor):
+        county_geocode(connection, cursor, quarter, prefix, samples, commit_interval)
     connection.close()
+    print_cache_stats()
 
 if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="geocode addresses in the database")
+    PARSER.add_argument("--samples", type=int, default=settings.GEO_SAMPLES, metavar="N",
+                        help="door numbers sampled per address range (default: %(default)s)")
+    PARSER.add_argument("--commit-interval", type=int, default=COMMIT_INTERVAL, metavar="N",
+                        help="most address ranges written per commit, a commit also precedes "
+                             "every call to providers (default: %(default)s)")
+    PARSER.add_argument("--worker", nargs="?", metavar="NAME",
+                        const="%s:%d" %(socket.gethostname(), os.getpid()),
+                        help="lease address ranges from the queue shared with other workers, "
+                             "e.g. one per GEO_CONFIG folder of API keys (default: host:pid)")
+    PARSER.add_argument("--lease", type=float, default=LEASE, metavar="SECONDS",
+                        help="seconds leases outlive a worker that stopped renewing them "
+                             "(default: %(default)s)")
+    ARGS = PARSER.parse_args()
+    if ARGS.worker:
+        worker(ARGS.worker, ARGS.samples, ARGS.commit_interval, ARGS.lease)
+        sys.exit()
+
     # clear terminal output
     if sys.platform.startswith("darwin"):
         os.system('clear')
@@ -111,10 +316,10 @@ if __name__ == "__main__":
     SERVER_MODE = True if (input("Activate server mode? [y/n]: ").lower() == "y") else False
     while SERVER_MODE:
         try:
-            main()
+            main(ARGS.samples, ARGS.commit_interval)
         except Exception as e:
             print("\nCaught exception: \n%s\n" %(e), file=sys.stderr)
             print("Restart in %d seconds..." %(SERVER_RESTART_INTERVAL), end='', flush=True)
             time.sleep(SERVER_RESTART_INTERVAL)
             print()
-    main()
+    main(ARGS.samples, ARGS.commit_interval)
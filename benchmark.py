@@ -0,0 +1,206 @@
+#pylint: disable=C0321
+"""
+    Benchmark csv ingestion with synthetic season folders
+"""
+
+# Standard Library
+import os
+import csv
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+# Dependent Module
+import settings
+import db_creator
+
+HEADER = ["鄉鎮市區", "交易標的", "土地區段位置或建物區門牌", "土地移轉總面積平方公尺",
+          "都市土地使用分區", "非都市土地使用分區", "非都市土地使用編定", "交易年月日",
+          "交易筆棟數", "移轉層次", "總樓層數", "建物型態", "主要用途", "主要建材", "建築完成年月",
+          "建物移轉總面積平方公尺", "建物現況格局-房", "建物現況格局-廳", "建物現況格局-衛",
+          "建物現況格局-隔間", "有無管理組織", "總價元", "單價每平方公尺", "車位類別",
+          "車位移轉總面積平方公尺", "車位總價元", "備註", "編號"]
+DISTRICTS = ["中正區", "大安區", "信義區", "北屯區", "東區", "苓雅區", "板橋區", "竹北市",
+             "頭份市", "員林市", "斗六市", "鹽埔鄉", "金峰鄉", "馬公市"]
+ROADS = ["中山路", "中正路", "民生東路二段", "和平東路三段", "復興北路", "文化路", "光復路",
+         "建國南路一段", "自由路", "成功路"]
+TARGETS = ["房地(土地+建物)", "房地(土地+建物)+車位", "建物", "土地", "車位"]
+BUILDINGS = ["住宅大樓(11層含以上有電梯)", "華廈(10層含以下有電梯)", "公寓(5樓含以下無電梯)",
+             "透天厝", "套房(1房1廳1衛)", "店面(店鋪)", "辦公商業大樓", "其他"]
+USAGES = ["住家用", "商業用", "住商用", "工業用", "見其他登記事項", ""]
+MATERIALS = ["鋼筋混凝土造", "鋼骨鋼筋混凝土造", "加強磚造", "鋼骨造", "見使用執照", ""]
+URBAN_ZONES = ["住", "商", "工", "農", "其他", ""]
+RURAL_ZONES = ["", "", "", "特定農業區", "一般農業區", "鄉村區"]
+RURAL_USES = ["", "", "", "甲種建築用地", "乙種建築用地", "農牧用地"]
+PARKINGS = ["", "", "坡道平面", "坡道機械", "升降機械", "一樓平面", "其他"]
+NOTES = ["", "", "", "親友、員工或其他特殊關係間之交易。", "含增建或未登記建物。"]
+NUMERALS = "一二三四五六七八九"
+
+def floor_cht(number: int) -> str:
+    """ convert Arabic number into Chinese level, inverse of db_creator.floor """
+    if number < 0:
+        return "地下" + floor_cht(-number)
+    (tens, ones) = divmod(number, 10)
+    text = ("" if tens <= 1 else NUMERALS[tens - 1]) + ("十" if tens else "")
+    return text + (NUMERALS[ones - 1] if ones else "") + "層"
+
+def synthetic_row(rand: random.Random, quarter: str, alpha: str, serial: int) -> list:
+    """ generate one csv row with the value mix of sold records """
+    lower = rand.randint(1, 300)
+    total = rand.randint(1, 30)
+    levels = [floor_cht(rand.choice([-2, -1] + list(range(1, total + 1))))
+              for _ in range(rand.choice([1, 1, 1, 2, 3]))]
+    price = rand.randint(50, 5000) * 10000
+    return [rand.choice(DISTRICTS), rand.choice(TARGETS),
+            "%s%s%d~%d號" %(rand.choice(DISTRICTS), rand.choice(ROADS), lower, lower + 29),
+            "%.2f" %(rand.uniform(5, 200)), rand.choice(URBAN_ZONES), rand.choice(RURAL_ZONES),
+            rand.choice(RURAL_USES), "1%02d%02d%02d" %(rand.randint(1, 9), rand.randint(1, 12),
+                                                      rand.randint(1, 28)),
+            "土地1建物1車位%d" %(rand.randint(0, 1)), "，".join(levels), floor_cht(total),
+            rand.choice(BUILDINGS), rand.choice(USAGES), rand.choice(MATERIALS),
+            "0%02d%02d%02d" %(rand.randint(60, 99), rand.randint(1, 12), rand.randint(1, 28)),
+            "%.2f" %(rand.uniform(20, 300)), str(rand.randint(0, 5)), str(rand.randint(0, 3)),
+            str(rand.randint(0, 3)), rand.choice(["有", "無"]), rand.choice(["有", "無"]),
+            str(price), str(price // rand.randint(30, 200)), rand.choice(PARKINGS), "0", "0",
+            rand.choice(NOTES), "RPBENCH%s%s%08d" %(quarter, alpha, serial)]
+
+def deal_header(deal: settings.Deal) -> list:
+    """ column names as published for a deal type """
+    aliases = {sold: published for (published, sold)
+               in db_creator.DEAL_ALIASES.get(deal, {}).items()}
+    return [aliases.get(fieldname, fieldname) for fieldname in HEADER]
+
+def generate(folder: str, quarters: int = 2, rows: int = 10000, counties: str = "ABEF",
+             seed: int = 0, deals: str = "A") -> list:
+    """ write big5 encoded season folders into folder, return names of seasons """
+    rand = random.Random(seed)
+    seasons = ["1%02dS%d" %(1 + index // 4, 1 + index % 4) for index in range(quarters)]
+    for season in seasons:
+        season_path = os.path.join(folder, season)
+        os.makedirs(season_path, exist_ok=True)
+        for alpha in counties:
+            for deal in deals:
+                file_name = "%s_lvr_land_%s.CSV" %(alpha, deal)
+                file_path = os.path.join(season_path, file_name)
+                with open(file_path, 'w', encoding='big5', newline='') as fstream:
+                    writer = csv.writer(fstream)
+                    writer.writerow(deal_header(settings.Deal(deal)))
+                    for serial in range(rows):
+                        writer.writerow(synthetic_row(rand, season, alpha, serial))
+    return seasons
+
+def timed(func, *args) -> float:
+    """ run func and return elapsed seconds """
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+def bench_normalize(folder: str, season: str) -> dict:
+    """ measure csv decoding, floor conversion and row normalization throughput """
+    source_path = os.path.join(folder, season)
+    rows = []
+    start = time.perf_counter()
+    for (name, _, fstream) in db_creator.open_csv(source_path):
+        rows.extend(db_creator.deal_reader(fstream, db_creator.deal_of(name)))
+    decode = time.perf_counter() - start
+
+    levels = [row["移轉層次"] for row in rows]
+    elapsed = timed(lambda: [db_creator.floor_all([f for f in level.split(sep="，")
+                                                   if f and f[-1] == "層"])
+                             for level in levels])
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    db_creator.init_db(cursor)
+    lookup = db_creator.LookupCache(cursor)
+    normalize = timed(lambda: [db_creator.normalize_row(dict(row), "臺北市", lookup)
+                               for row in rows])
+    connection.close()
+    return {"rows": len(rows),
+            "decode_rows_per_sec": len(rows) / decode,
+            "floor_all_per_sec": len(levels) / elapsed,
+            "normalize_rows_per_sec": len(rows) / normalize}
+
+def bench_tables(folder: str, season: str, unified: bool) -> dict:
+    """ measure executemany cost of each data table separately """
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    db_creator.init_db(cursor, unified)
+    lookup = db_creator.LookupCache(cursor)
+    db_creator.create_table(cursor, season, unified)
+    sql = db_creator.statements(season, unified)
+    params = {table: [] for table in sql}
+    for (name, root, fstream) in db_creator.open_csv(os.path.join(folder, season)):
+        if db_creator.deal_of(name) is not settings.Deal.sold:
+            continue
+        for row in csv.DictReader(fstream):
+            values = db_creator.normalize_row(row, settings.alpha2cht(root[0]), lookup)
+            if values is None:
+                continue
+            for table in params:
+                params[table].append(values[table])
+    results = {}
+    for (table, values) in params.items():
+        elapsed = timed(cursor.executemany, sql[table], values)
+        results[table] = {"rows": len(values),
+                          "usec_per_row": elapsed / len(values) * 1e6 if values else 0}
+    connection.close()
+    return results
+
+def bench_import(folder: str, batch_size: int, jobs: int, bulk: bool) -> dict:
+    """ measure end-to-end import of every season in folder into a new database """
+    # point db_creator at the synthetic seasons instead of the real resources
+    settings.__resources__ = folder
+    settings.__main_db__ = os.path.join(folder, "main.db")
+    if os.path.exists(settings.__main_db__):
+        os.remove(settings.__main_db__)
+    elapsed = timed(db_creator.main, batch_size, jobs, False, bulk)
+    connection = sqlite3.connect(settings.__main_db__)
+    rows = sum(connection.execute("SELECT count(*) FROM {0};".format(
+        db_creator.deal_table("TRX", deal))).fetchone()[0] for deal in settings.Deal)
+    connection.close()
+    return {"rows": rows, "seconds": elapsed, "rows_per_sec": rows / elapsed}
+
+def main(args: argparse.Namespace):
+    """ Main Process """
+    with tempfile.TemporaryDirectory() as scratch:
+        folder = args.generate if args.generate else scratch
+        start = time.perf_counter()
+        seasons = generate(folder, args.quarters, args.rows, args.counties, args.seed, args.deals)
+        print("Generated %d seasons in %.1f seconds" %(len(seasons), time.perf_counter() - start))
+        if args.generate:
+            return
+        results = {
+            "config": vars(args),
+            "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                            "machine": platform.machine(), "cpus": os.cpu_count()},
+            "createdAt": datetime.now().isoformat(timespec="seconds"),
+            "normalize": bench_normalize(folder, seasons[0]),
+            "tables": bench_tables(folder, seasons[0], unified=True),
+            "import": bench_import(folder, args.batch, args.jobs, args.bulk)
+        }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump(results, stream, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="benchmark csv ingestion with synthetic data")
+    PARSER.add_argument("--rows", type=int, default=10000, help="rows per county file")
+    PARSER.add_argument("--quarters", type=int, default=2, help="number of season folders")
+    PARSER.add_argument("--counties", default="ABEF", help="county letters, e.g. ABEF")
+    PARSER.add_argument("--deals", default="A",
+                        help="deal type letters, A sold, B presold, C rent, e.g. ABC")
+    PARSER.add_argument("--seed", type=int, default=0, help="seed of random generator")
+    PARSER.add_argument("--batch", type=int, default=db_creator.BATCH_SIZE, metavar="N",
+                        help="batch size passed to db_creator")
+    PARSER.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="worker processes passed to db_creator")
+    PARSER.add_argument("--bulk", action="store_true", help="import with bulk-load profile")
+    PARSER.add_argument("--generate", metavar="DIR",
+                        help="only write synthetic season folders into DIR")
+    PARSER.add_argument("--output", metavar="FILE", help="write results as json into FILE")
+    main(PARSER.parse_args())
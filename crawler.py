@@ -5,71 +5,235 @@
 # Standard Python Library
 import os
 import re
+import time
 import errno
-from io import BytesIO
+import shutil
+import hashlib
+import argparse
+from functools import partial
 from zipfile import ZipFile
 from multiprocessing.dummy import Lock as ThreadLock
 from multiprocessing.dummy import Pool as ThreadPool
 # Third Party Library
+import yaml
 import requests
 import settings
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
 HISTORY_LIST_URL = "http://plvr.land.moi.gov.tw/DownloadHistory_ajax_list"
-def update_check():
-    """ Check for new seasonal updates """
-    seasons = []
-    recent_resources = os.listdir(settings.__resources__)
-    history_page = requests.get(HISTORY_LIST_URL)
-    soup = BeautifulSoup(history_page.text, "html.parser")
-    for season_option in soup.select("select#historySeason_id > option"):
-        season = season_option.get('value')
-        if season not in recent_resources:
-            seasons.append(season)
-    return seasons
-
-SHARED_LOCK = ThreadLock()
 DOWNLOAD_BASE_URL = "http://plvr.land.moi.gov.tw/DownloadHistory?type=season&fileName={}"
-def downloader(season: str):
-    """ Download files and extract to resources folder """
-    url = DOWNLOAD_BASE_URL.format(season)
-    http_header = requests.head(url).headers
-    if "Content-Disposition" in http_header:
-        file_name = re.search('attachment;filename="(.*)"', \
-		                      http_header["Content-Disposition"]).group(1)
-    else:
-        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), url)
-    if "Content-Length" in http_header:
-        file_size = int(http_header["Content-Length"])
-    # locks stdout
-    SHARED_LOCK.acquire()
-    print("Address: " + url)
-    print("FileName: '" +  file_name + "'" if file_name else "FileName: Unknown")
-    print("Size: " + settings.format_bytes(file_size) if file_size else "Size: Unknown")
-    SHARED_LOCK.release()
-    # download file
-    downloaded_file = requests.get(url)
-    # unzip csv file into folder
-    zipped_file = ZipFile(BytesIO(downloaded_file.content))
-    folder_name = os.path.join(settings.__resources__, season)
-    if not os.path.exists(folder_name):
-        os.makedirs(folder_name)
-    for data_name in zipped_file.namelist():
-        if os.path.splitext(data_name)[1].lower() == '.csv':
-            zipped_file.extract(data_name, folder_name)
+CHUNK_SIZE = 1 << 20
+JOBS = 4
+TIMEOUT = (10, 60)  # seconds to connect, seconds between received bytes
+RETRIES = 3
+BACKOFF = 1.0       # seconds before first retry, doubled on each further retry
+MANIFEST = "manifest.yaml"
+SHARED_LOCK = ThreadLock()
+MANIFEST_LOCK = ThreadLock()
+
+def has_season(season: str) -> bool:
+    """ check season is in resources folder, extracted or as archive """
+    return (os.path.isdir(os.path.join(settings.__resources__, season)) or
+            os.path.isfile(os.path.join(settings.__resources__, season + ".zip")))
+
+def save_stream(response: requests.Response, fstream) -> int:
+    """ write response body into file in fixed-size chunks, return written bytes """
+    written = 0
+    for chunk in response.iter_content(CHUNK_SIZE):
+        fstream.write(chunk)
+        written += len(chunk)
+    return written
+
+class Crawler(object):
+    """ bounded pool of season downloads sharing one keep-alive http session """
+    def __init__(self, jobs: int = JOBS, timeout: tuple = TIMEOUT, retries: int = RETRIES,
+                 backoff: float = BACKOFF, history_url: str = HISTORY_LIST_URL,
+                 download_url: str = DOWNLOAD_BASE_URL):
+        self.jobs = max(1, jobs)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.history_url = history_url
+        self.download_url = download_url
+        self.session = requests.Session()
+        # one connection per worker thread, reused across seasons
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.jobs)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.manifest = {}
+        manifest_name = os.path.join(settings.__resources__, MANIFEST)
+        if os.path.exists(manifest_name):
+            with open(manifest_name, "r", encoding="utf-8") as stream:
+                self.manifest = yaml.safe_load(stream) or {}
+    def close(self):
+        """ close pooled connections """
+        self.session.close()
+    def retry(self, func, *args, **kwargs):
+        """ call func, retrying transient http errors with exponential backoff """
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except requests.HTTPError as err:
+                # client errors will not go away by asking again
+                if attempt == self.retries or err.response.status_code < 500:
+                    raise
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError):
+                if attempt == self.retries:
+                    raise
+            time.sleep(self.backoff * (2 ** attempt))
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """ send request through pooled session, raise on error status """
+        response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+        return response
+
+    def update_manifest(self, season: str, **fields):
+        """ merge fields into manifest entry of season and write manifest atomically """
+        manifest_name = os.path.join(settings.__resources__, MANIFEST)
+        with MANIFEST_LOCK:
+            self.manifest.setdefault(season, {}).update(fields)
+            with open(manifest_name + ".tmp", "w", encoding="utf-8") as stream:
+                yaml.safe_dump(self.manifest, stream, default_flow_style=False, allow_unicode=True)
+            os.replace(manifest_name + ".tmp", manifest_name)
+
+    def update_check(self, recheck: bool = False) -> list:
+        """ Check for new seasonal updates, or list every season to revalidate """
+        seasons = []
+        recent_resources = [os.path.splitext(name)[0] if name.lower().endswith(".zip") else name
+                            for name in os.listdir(settings.__resources__)]
+        history_page = self.retry(self.request, "GET", self.history_url)
+        soup = BeautifulSoup(history_page.text, "html.parser")
+        for season_option in soup.select("select#historySeason_id > option"):
+            season = season_option.get('value')
+            if recheck or season not in recent_resources:
+                seasons.append(season)
+        return seasons
+
+    def fetch(self, season: str, url: str, part_name: str) -> bool:
+        """ download url into part file, resuming an interrupted transfer, False if unchanged """
+        entry = self.manifest.get(season, {})
+        offset = os.path.getsize(part_name) if os.path.exists(part_name) else 0
+        validator = entry.get("etag") or entry.get("last_modified")
+        http_header = {}
+        if offset and validator:
+            if offset == entry.get("size"):
+                return True
+            # If-Range makes server send the whole file again if it changed meanwhile
+            http_header["Range"] = "bytes=%d-" %(offset)
+            http_header["If-Range"] = validator
+        elif entry.get("sha1") and has_season(season):
+            if entry.get("etag"):
+                http_header["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                http_header["If-Modified-Since"] = entry["last_modified"]
+        with self.request("GET", url, headers=http_header, stream=True) as response:
+            if response.status_code == 304:
+                return False
+            if "Content-Disposition" in response.headers:
+                file_name = re.search('attachment;filename="(.*)"', \
+                                      response.headers["Content-Disposition"]).group(1)
+            else:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), url)
+            resumed = response.status_code == 206
+            if not resumed:
+                # remember validators first, so a transfer cut short can resume
+                offset = 0
+                self.update_manifest(season, file_name=file_name, sha1=None,
+                                     etag=response.headers.get("ETag"),
+                                     last_modified=response.headers.get("Last-Modified"),
+                                     size=int(response.headers.get("Content-Length", 0)) or None)
+            file_size = self.manifest[season].get("size")
+            # locks stdout
+            SHARED_LOCK.acquire()
+            print("Address: " + url)
+            print("FileName: '" +  file_name + "'" if file_name else "FileName: Unknown")
+            print("Size: " + settings.format_bytes(file_size) if file_size else "Size: Unknown")
+            if resumed:
+                print("Resume: " + settings.format_bytes(offset))
+            SHARED_LOCK.release()
+            with open(part_name, "ab" if resumed else "wb") as archive:
+                save_stream(response, archive)
+        return True
+    def downloader(self, season: str, keep_zip: bool = False):
+        """ Download files and extract to resources folder, or keep the archive only """
+        url = self.download_url.format(season)
+        archive_name = os.path.join(settings.__resources__, season + ".zip")
+        # download file chunk by chunk into a part file, so archives never sit in memory
+        previous = self.manifest.get(season, {}).get("sha1")
+        if not self.retry(self.fetch, season, url, archive_name + ".part"):
+            return
+        sha1 = hashlib.sha1()
+        with open(archive_name + ".part", "rb") as archive:
+            for chunk in iter(lambda: archive.read(CHUNK_SIZE), b""):
+                sha1.update(chunk)
+        self.update_manifest(season, sha1=sha1.hexdigest())
+        if sha1.hexdigest() == previous and has_season(season):
+            # republished without changes
+            os.remove(archive_name + ".part")
+            return
+        folder_name = os.path.join(settings.__resources__, season)
+        if keep_zip:
+            if os.path.isdir(folder_name):
+                # db_creator prefers an extracted folder, which would hide the republished archive
+                shutil.rmtree(folder_name)
+            # db_creator streams csv files straight out of the archive
+            os.replace(archive_name + ".part", archive_name)
+            return
+        # unzip csv file into folder
+        with ZipFile(archive_name + ".part") as zipped_file:
+            if not os.path.exists(folder_name):
+                os.makedirs(folder_name)
+            for data_name in zipped_file.namelist():
+                if os.path.splitext(data_name)[1].lower() == '.csv':
+                    zipped_file.extract(data_name, folder_name)
+        os.remove(archive_name + ".part")
+
+    def download_all(self, seasons: list, keep_zip: bool = False):
+        """ download seasons with at most jobs transfers at a time """
+        pool = ThreadPool(min(self.jobs, len(seasons)))
+        try:
+            pool.map(partial(self.downloader, keep_zip=keep_zip), seasons)
+        finally:
+            pool.close()
+            pool.join()
 
-def main():
+def main(keep_zip: bool = False, crawler: Crawler = None, recheck: bool = False):
     """ Main Function """
-    print("Checking for updates...")
-    new_files = update_check()
-    file_count = len(new_files)
-    if file_count:
-        print("Missing %d files\n" %(file_count))
-        print("Downloading...")
-        pool = ThreadPool(file_count)
-        pool.map(downloader, new_files)
-        pool.close()
-    print("\nFinish")
+    crawler = crawler if crawler else Crawler()
+    try:
+        print("Checking for updates...")
+        new_files = crawler.update_check(recheck)
+        file_count = len(new_files)
+        if file_count:
+            print(("Checking %d files\n" if recheck else "Missing %d files\n") %(file_count))
+            print("Downloading...")
+            crawler.download_all(new_files, keep_zip)
+        print("\nFinish")
+    finally:
+        crawler.close()
 
 if __name__ == "__main__":
-    main()
+    PARSER = argparse.ArgumentParser(description="crawl csv files of actual price registration")
+    PARSER.add_argument("--keep-zip", action="store_true",
+                        help="keep compressed season archives instead of extracting csv files")
+    PARSER.add_argument("--recheck", action="store_true",
+                        help="revalidate downloaded seasons with conditional requests")
+    PARSER.add_argument("--jobs", type=int, default=JOBS, metavar="N",
+                        help="download at most N seasons at once (default: %(default)s)")
+    PARSER.add_argument("--timeout", type=float, default=TIMEOUT[1], metavar="SEC",
+                        help="give up on a silent connection after SEC seconds")
+    PARSER.add_argument("--retries", type=int, default=RETRIES, metavar="N",
+                        help="retry transient errors N times with exponential backoff")
+    PARSER.add_argument("--history-url", default=HISTORY_LIST_URL, metavar="URL",
+                        help="season list page, e.g. of a local mirror")
+    PARSER.add_argument("--download-url", default=DOWNLOAD_BASE_URL, metavar="URL",
+                        help="season download url with {} in place of the season")
+    ARGS = PARSER.parse_args()
+    main(ARGS.keep_zip, Crawler(ARGS.jobs, (TIMEOUT[0], ARGS.timeout), ARGS.retries, BACKOFF,
+                                ARGS.history_url, ARGS.download_url), ARGS.recheck)
@@ -4,15 +4,42 @@
 """
 
 # Standard Library
+import io
 import os
 import csv
+import sys
+import time
+import hashlib
 import pprint
 import sqlite3
+import argparse
+from zipfile import ZipFile
+from multiprocessing import Pool
 # Dependent Module
 import settings
+from geo.address import address_key
 
 __version__ = "0.1"
 IMPORTED_FOLDERS = "IMPORTED_FOLDERS"
+IMPORTED_FILES = "IMPORTED_FILES"
+ADDRESS_KEY = "ADDRESS_KEY"
+BATCH_SIZE = 5000
+LEGACY_SCHEMA = 1   # five data tables per quarter, e.g. "101S4/TRX"
+UNIFIED_SCHEMA = 2  # one data table per kind keyed by (quarter, 編號)
+DATA_TABLES = ("TRX", "GEO", "BUILD", "LAND", "PARK")
+BULK_PRAGMAS = {"journal_mode": "WAL", "cache_size": -262144,  # 256 MiB
+                "mmap_size": 1 << 30, "temp_store": "MEMORY"}
+SAFE_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL", "cache_size": -2000,
+                "mmap_size": 0, "temp_store": "DEFAULT"}
+DURABILITY = ("full", "normal", "off")
+INDEXES = {
+    # name: (table, per-quarter columns, unified columns, condition)
+    # covers address_geocoder grouping addresses of a county and picking their 編號
+    "address": ("TRX", "縣市, 土地區段位置或建物區門牌, 編號",
+                "縣市, quarter, 土地區段位置或建物區門牌, 編號", ""),
+    # rows still waiting to be geocoded
+    "pending": ("GEO", "編號", "quarter, 編號", "WHERE LAT_Avg IS NULL")
+}
 
 FLOOR_CHT = ["", "一", "二", "三", "四", "五", "六", "七", "八", "九"]
 def floor(txt: str) -> int:
@@ -38,7 +65,41 @@ def floor_all(lst: list) -> list:
     numerals = [floor(txt) for txt in lst if floor(txt)]
     return sorted(numerals)
 
-def init_db(cur: sqlite3.Cursor) -> str:
+def bulk_load(cur: sqlite3.Cursor, durability: str = "normal"):
+    """ switch connection to bulk-load profile, never meant for long-running connections """
+    for (pragma, value) in BULK_PRAGMAS.items():
+        cur.execute("PRAGMA {0} = {1};".format(pragma, value))
+    cur.execute("PRAGMA synchronous = {0};".format(durability.upper()))
+def restore_safe(cur: sqlite3.Cursor):
+    """ switch connection back to default durable settings """
+    # leaving WAL checkpoints the log back into the database file
+    for (pragma, value) in SAFE_PRAGMAS.items():
+        cur.execute("PRAGMA {0} = {1};".format(pragma, value))
+
+def schema_version(cur: sqlite3.Cursor) -> int:
+    """ get schema version of database, new databases start with unified schema """
+    cur.execute("PRAGMA user_version;")
+    version = cur.fetchone()[0]
+    if not version:
+        cur.execute('''SELECT EXISTS(
+                           SELECT * FROM sqlite_master WHERE type == 'table' AND name LIKE '%/TRX'
+                       );''')
+        version = LEGACY_SCHEMA if cur.fetchone()[0] else UNIFIED_SCHEMA
+        cur.execute("PRAGMA user_version = {0};".format(version))
+    return version
+def deal_table(name: str, deal: settings.Deal = settings.Deal.sold) -> str:
+    """ name of data table kind for a deal type, e.g. TRX of sold or RENT_TRX of rent """
+    return name if deal is settings.Deal.sold else "{0}_{1}".format(deal.name.upper(), name)
+def table_name(prefix: str, name: str, unified: bool,
+               deal: settings.Deal = settings.Deal.sold) -> str:
+    """ quoted name of data table holding a quarter """
+    name = deal_table(name, deal)
+    return '"{0}"'.format(name) if unified else '"{0}/{1}"'.format(prefix, name)
+def quote(text: str) -> str:
+    """ quote text as sql string literal """
+    return "'{0}'".format(text.replace("'", "''"))
+
+def init_db(cur: sqlite3.Cursor, unified: bool = False) -> str:
     """ initialize database with essential data tables """
     cur.execute('''CREATE TABLE IF NOT EXISTS {0}(
                        quarter TEXT PRIMARY KEY,
@@ -47,6 +108,23 @@ def init_db(cur: sqlite3.Cursor) -> str:
                            geocode_log >= 0 AND geocode_log <= 67108863
                        )
                    );'''.format(IMPORTED_FOLDERS))
+    cur.execute('''CREATE TABLE IF NOT EXISTS {0}(
+                       quarter TEXT NOT NULL,
+                       file TEXT NOT NULL,
+                       size INTEGER NOT NULL,
+                       modifiedAt TEXT NOT NULL,
+                       sha1 TEXT NOT NULL,
+                       rows INTEGER NOT NULL,
+                       importedAt TEXT NOT NULL,
+                       PRIMARY KEY(quarter, file)
+                   );'''.format(IMPORTED_FILES))
+    # canonical key of every address seen in a county, so address_geocoder visits variants once
+    cur.execute('''CREATE TABLE IF NOT EXISTS {0}(
+                       county TEXT NOT NULL,
+                       address TEXT NOT NULL,
+                       key TEXT NOT NULL,
+                       PRIMARY KEY(county, address)
+                   );'''.format(ADDRESS_KEY))
     cur.execute('''CREATE TABLE IF NOT EXISTS 建物型態(
                        id INTEGER PRIMARY KEY AUTOINCREMENT,
                        type TEXT NOT NULL UNIQUE,
@@ -82,11 +160,113 @@ def init_db(cur: sqlite3.Cursor) -> str:
                        type TEXT NOT NULL UNIQUE,
                        count INTEGER DEFAULT 0
                    );''')
+    if unified:
+        for deal in settings.Deal:
+            create_unified_table(cur, deal)
     cur.execute("SELECT quarter FROM {0}".format(IMPORTED_FOLDERS))
     return [t[0] for t in cur.fetchall()]
-def create_table(cur: sqlite3.Cursor, prefix: str):
-    """ create data tables with the same prefix """
-    cur.execute('''CREATE TABLE IF NOT EXISTS "{0}/TRX"(
+def create_unified_table(cur: sqlite3.Cursor, deal: settings.Deal = settings.Deal.sold):
+    """ create data tables of a deal type shared by all quarters """
+    tables = {name: table_name(None, name, True, deal) for name in DATA_TABLES}
+    cur.execute('''CREATE TABLE IF NOT EXISTS {TRX}(
+                       quarter TEXT NOT NULL,
+                       編號 TEXT NOT NULL,
+                       縣市 TEXT NOT NULL CHECK(length(縣市) == 3),
+                       鄉鎮市區 TEXT NOT NULL CHECK(length(鄉鎮市區) <= 4),
+                       土地區段位置或建物區門牌 TEXT NOT NULL,
+                       交易年月日 TEXT NOT NULL,
+                       總價元 INTEGER NOT NULL,
+                       單價每平方公尺 INTEGER,
+                       親友間交易 INTEGER NOT NULL,
+                       含增建 INTEGER NOT NULL,
+                       PRIMARY KEY(quarter, 編號)
+                   );'''.format(**tables))
+    cur.execute('''CREATE TABLE IF NOT EXISTS {GEO}(
+                       quarter TEXT NOT NULL,
+                       編號 TEXT NOT NULL,
+                       LAT_1 REAL, LON_1 REAL,
+                       LAT_2 REAL, LON_2 REAL,
+                       LAT_3 REAL, LON_3 REAL,
+                       LAT_4 REAL, LON_4 REAL,
+                       LAT_5 REAL, LON_5 REAL,
+                       LAT_Avg REAL, LON_Avg REAL,
+                       PRIMARY KEY(quarter, 編號),
+                       FOREIGN KEY(quarter, 編號) REFERENCES {TRX}(quarter, 編號)
+                   );'''.format(**tables))
+    cur.execute('''CREATE TABLE IF NOT EXISTS {BUILD}(
+                       quarter TEXT NOT NULL,
+                       編號 TEXT NOT NULL,
+                       總樓層數 INTEGER,
+                       移轉層次 TEXT,
+                       建物型態 INTEGER NOT NULL,
+                       主要用途 INTEGER,
+                       主要建材 INTEGER,
+                       建築完成年月 TEXT,
+                       建物移轉總面積平方公尺 INTEGER NOT NULL,
+                       '建物現況格局-隔間' INTEGER NOT NULL,
+                       '建物現況格局-房' INTEGER NOT NULL,
+                       '建物現況格局-廳' INTEGER NOT NULL,
+                       '建物現況格局-衛' INTEGER NOT NULL,
+                       有無管理組織 INTEGER NOT NULL,
+                       PRIMARY KEY(quarter, 編號),
+                       FOREIGN KEY(quarter, 編號) REFERENCES {TRX}(quarter, 編號),
+                       FOREIGN KEY(建物型態) REFERENCES 建物型態(id),
+                       FOREIGN KEY(主要用途) REFERENCES 主要用途(id),
+                       FOREIGN KEY(主要建材) REFERENCES 主要建材(id)
+                   );'''.format(**tables))
+    cur.execute('''CREATE TABLE IF NOT EXISTS {LAND}(
+                       quarter TEXT NOT NULL,
+                       編號 TEXT NOT NULL,
+                       土地移轉總面積平方公尺 REAL NOT NULL,
+                       都市土地使用分區 INTEGER,
+                       非都市土地使用分區 INTEGER,
+                       非都市土地使用編定 INTEGER,
+                       PRIMARY KEY(quarter, 編號),
+                       FOREIGN KEY(quarter, 編號) REFERENCES {TRX}(quarter, 編號),
+                       FOREIGN KEY(都市土地使用分區) REFERENCES 都市土地使用分區(id),
+                       FOREIGN KEY(非都市土地使用分區) REFERENCES 非都市土地使用分區(id),
+                       FOREIGN KEY(非都市土地使用編定) REFERENCES 非都市土地使用編定(id)
+                   );'''.format(**tables))
+    cur.execute('''CREATE TABLE IF NOT EXISTS {PARK}(
+                       quarter TEXT NOT NULL,
+                       編號 TEXT NOT NULL,
+                       車位類別 INTEGER,
+                       車位移轉總面積平方公尺 REAL NOT NULL,
+                       車位總價元 INTEGER NOT NULL,
+                       PRIMARY KEY(quarter, 編號),
+                       FOREIGN KEY(quarter, 編號) REFERENCES {TRX}(quarter, 編號),
+                       FOREIGN KEY(車位類別) REFERENCES 車位類別(id)
+                   );'''.format(**tables))
+def create_view(cur: sqlite3.Cursor, prefix: str, deal: settings.Deal = settings.Deal.sold):
+    """ create views of a quarter under the names of its former per-quarter tables """
+    for name in DATA_TABLES:
+        name = deal_table(name, deal)
+        cur.execute('PRAGMA table_info("{0}");'.format(name))
+        columns = ", ".join('"{0}"'.format(column[1]) for column in cur.fetchall()
+                            if column[1] != "quarter")
+        cur.execute('''CREATE VIEW IF NOT EXISTS "{0}/{1}" AS
+                       SELECT {2} FROM {1} WHERE quarter == {3};'''.format(
+                           prefix, name, columns, quote(prefix)))
+    # address_geocoder writes coordinates through the view
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS "{0}/{2}/UPDATE" INSTEAD OF UPDATE ON "{0}/{2}"
+                   BEGIN
+                       UPDATE {2} SET
+                           LAT_1 = NEW.LAT_1, LON_1 = NEW.LON_1,
+                           LAT_2 = NEW.LAT_2, LON_2 = NEW.LON_2,
+                           LAT_3 = NEW.LAT_3, LON_3 = NEW.LON_3,
+                           LAT_4 = NEW.LAT_4, LON_4 = NEW.LON_4,
+                           LAT_5 = NEW.LAT_5, LON_5 = NEW.LON_5,
+                           LAT_Avg = NEW.LAT_Avg, LON_Avg = NEW.LON_Avg
+                       WHERE quarter == {1} AND 編號 == OLD.編號;
+                   END;'''.format(prefix, quote(prefix), deal_table("GEO", deal)))
+def create_table(cur: sqlite3.Cursor, prefix: str, unified: bool = False,
+                 deal: settings.Deal = settings.Deal.sold):
+    """ create data tables of a deal type with the same prefix """
+    if unified:
+        create_view(cur, prefix, deal)
+        return
+    tables = {name: table_name(prefix, name, False, deal) for name in DATA_TABLES}
+    cur.execute('''CREATE TABLE IF NOT EXISTS {TRX}(
                        編號 TEXT PRIMARY KEY,
                        縣市 TEXT NOT NULL CHECK(length(縣市) == 3),
                        鄉鎮市區 TEXT NOT NULL CHECK(length(鄉鎮市區) <= 4),
@@ -96,8 +276,8 @@ def create_table(cur: sqlite3.Cursor, prefix: str):
                        單價每平方公尺 INTEGER,
                        親友間交易 INTEGER NOT NULL,
                        含增建 INTEGER NOT NULL
-                   );'''.format(prefix))
-    cur.execute('''CREATE TABLE IF NOT EXISTS "{0}/GEO"(
+                   );'''.format(**tables))
+    cur.execute('''CREATE TABLE IF NOT EXISTS {GEO}(
                        編號 TEXT PRIMARY KEY,
                        LAT_1 REAL, LON_1 REAL,
                        LAT_2 REAL, LON_2 REAL,
@@ -105,9 +285,9 @@ def create_table(cur: sqlite3.Cursor, prefix: str):
                        LAT_4 REAL, LON_4 REAL,
                        LAT_5 REAL, LON_5 REAL,
                        LAT_Avg REAL, LON_Avg REAL,
-                       FOREIGN KEY(編號) REFERENCES "{0}/TRX"(編號)
-                   );'''.format(prefix))
-    cur.execute('''CREATE TABLE IF NOT EXISTS "{0}/BUILD"(
+                       FOREIGN KEY(編號) REFERENCES {TRX}(編號)
+                   );'''.format(**tables))
+    cur.execute('''CREATE TABLE IF NOT EXISTS {BUILD}(
                        編號 TEXT PRIMARY KEY,
                        總樓層數 INTEGER,
                        移轉層次 TEXT,
@@ -121,140 +301,726 @@ def create_table(cur: sqlite3.Cursor, prefix: str):
                        '建物現況格局-廳' INTEGER NOT NULL,
                        '建物現況格局-衛' INTEGER NOT NULL,
                        有無管理組織 INTEGER NOT NULL,
-                       FOREIGN KEY(編號) REFERENCES "{0}/TRX"(編號),
+                       FOREIGN KEY(編號) REFERENCES {TRX}(編號),
                        FOREIGN KEY(建物型態) REFERENCES 建物型態(id),
                        FOREIGN KEY(主要用途) REFERENCES 主要用途(id),
                        FOREIGN KEY(主要建材) REFERENCES 主要建材(id)
-                   );'''.format(prefix))
-    cur.execute('''CREATE TABLE IF NOT EXISTS "{0}/LAND"(
+                   );'''.format(**tables))
+    cur.execute('''CREATE TABLE IF NOT EXISTS {LAND}(
                        編號 TEXT PRIMARY KEY,
                        土地移轉總面積平方公尺 REAL NOT NULL,
                        都市土地使用分區 INTEGER,
                        非都市土地使用分區 INTEGER,
                        非都市土地使用編定 INTEGER,
-                       FOREIGN KEY(編號) REFERENCES "{0}/TRX"(編號),
+                       FOREIGN KEY(編號) REFERENCES {TRX}(編號),
                        FOREIGN KEY(都市土地使用分區) REFERENCES 都市土地使用分區(id),
                        FOREIGN KEY(非都市土地使用分區) REFERENCES 非都市土地使用分區(id),
                        FOREIGN KEY(非都市土地使用編定) REFERENCES 非都市土地使用編定(id)
-                   );'''.format(prefix))
-    cur.execute('''CREATE TABLE IF NOT EXISTS "{0}/PARK"(
+                   );'''.format(**tables))
+    cur.execute('''CREATE TABLE IF NOT EXISTS {PARK}(
                        編號 TEXT PRIMARY KEY,
                        車位類別 INTEGER,
                        車位移轉總面積平方公尺 REAL NOT NULL,
                        車位總價元 INTEGER NOT NULL,
-                       FOREIGN KEY(編號) REFERENCES "{0}/TRX"(編號),
+                       FOREIGN KEY(編號) REFERENCES {TRX}(編號),
                        FOREIGN KEY(車位類別) REFERENCES 車位類別(id)
-                   );'''.format(prefix))
-
-def parse_csv(rdr: csv.DictReader, cur: sqlite3.Cursor, prefix: str, county: str):
-    """ insert csv into specified data table """
-
-    def exist_row(picked_row: dict, fieldname: str):
-        """ insert new type into specified table or increase count when already exists """
-        if (not picked_row[fieldname]) or ("見" in picked_row[fieldname]):
-            return
-        cur.execute("SELECT EXISTS(SELECT * FROM {0} WHERE type == ?);".format(fieldname),
-                    (picked_row[fieldname],))
-        if not cur.fetchall()[0][0]:
-            cur.execute("INSERT INTO {0}(type) VALUES(?);".format(fieldname),
-                        (picked_row[fieldname],))
-        cur.execute("UPDATE {0} SET count = count + 1 WHERE type = ?;".format(fieldname),
-                    (picked_row[fieldname],))
+                   );'''.format(**tables))
 
+def index_statements(prefix: str, unified: bool = False) -> dict:
+    """ prepare create statements of managed indexes, keyed by quoted index name """
+    sql = {}
+    for (name, (table, columns, unified_columns, condition)) in INDEXES.items():
+        index = '"{0}/{1}"'.format(table_name(prefix, table, unified)[1:-1], name)
+        sql[index] = "CREATE INDEX IF NOT EXISTS {0} ON {1}({2}) {3}".format(
+            index, table_name(prefix, table, unified),
+            unified_columns if unified else columns, condition).rstrip() + ";"
+    return sql
+def create_index(cur: sqlite3.Cursor, prefix: str, unified: bool = False):
+    """ create managed indexes of a quarter, or of unified tables """
+    for statement in index_statements(prefix, unified).values():
+        cur.execute(statement)
+def drop_index(cur: sqlite3.Cursor, prefix: str, unified: bool = False):
+    """ drop managed indexes of a quarter, or of unified tables """
+    for index in index_statements(prefix, unified):
+        cur.execute("DROP INDEX IF EXISTS {0};".format(index))
+def verify_index(cur: sqlite3.Cursor, quarters: list, unified: bool = False) -> list:
+    """ check managed indexes exist and agree with their tables, return found problems """
+    problems = []
+    for prefix in ([None] if unified else quarters):
+        for index in index_statements(prefix, unified):
+            cur.execute("SELECT EXISTS(SELECT * FROM sqlite_master WHERE type == 'index' AND name == ?);",
+                        (index[1:-1],))
+            if not cur.fetchone()[0]:
+                problems.append("missing index " + index)
+        for name in set(table for (table, _, _, _) in INDEXES.values()):
+            cur.execute("PRAGMA integrity_check({0});".format(table_name(prefix, name, unified)))
+            problems.extend(result for result, in cur.fetchall() if result != "ok")
+    return problems
+def rebuild_index(cur: sqlite3.Cursor, quarters: list, unified: bool = False):
+    """ drop and recreate managed indexes of all quarters """
+    for prefix in ([None] if unified else quarters):
+        drop_index(cur, prefix, unified)
+        create_index(cur, prefix, unified)
+
+SOLD_FIELDS = ("鄉鎮市區", "交易標的", "土地區段位置或建物區門牌", "土地移轉總面積平方公尺",
+               "都市土地使用分區", "非都市土地使用分區", "非都市土地使用編定", "交易年月日",
+               "移轉層次", "總樓層數", "建物型態", "主要用途", "主要建材", "建築完成年月",
+               "建物移轉總面積平方公尺", "建物現況格局-房", "建物現況格局-廳", "建物現況格局-衛",
+               "建物現況格局-隔間", "有無管理組織", "總價元", "單價每平方公尺", "車位類別",
+               "車位移轉總面積平方公尺", "車位總價元", "備註", "編號")
+DEAL_ALIASES = {
+    # rent records name the same columns after leasing instead of transfer
+    settings.Deal.rent: {"租賃標的": "交易標的", "租賃年月日": "交易年月日", "租賃層次": "移轉層次",
+                         "租賃筆棟數": "交易筆棟數",
+                         "土地面積平方公尺": "土地移轉總面積平方公尺",
+                         "建物總面積平方公尺": "建物移轉總面積平方公尺", "總額元": "總價元",
+                         "單價元平方公尺": "單價每平方公尺", "車位面積平方公尺": "車位移轉總面積平方公尺",
+                         "車位總額元": "車位總價元"}
+}
+LOOKUP_FIELDS = ("建物型態", "主要用途", "主要建材",
+                 "都市土地使用分區", "非都市土地使用分區", "非都市土地使用編定", "車位類別")
+LOOKUP_COLUMNS = {"BUILD": ("建物型態", "主要用途", "主要建材"),
+                  "LAND": ("都市土地使用分區", "非都市土地使用分區", "非都市土地使用編定"),
+                  "PARK": ("車位類別",)}
+class LookupCache(object):
+    """ dictionary encoding of lookup tables, assigns ids locally and writes counts back on flush """
+    def __init__(self, cur: sqlite3.Cursor):
+        self.ids = {}; self.next_id = {}; self.added = {}; self.delta = {}
+        for fieldname in LOOKUP_FIELDS:
+            cur.execute("SELECT type, id FROM {0};".format(fieldname))
+            self.ids[fieldname] = dict(cur.fetchall())
+            cur.execute('''SELECT max(ifnull(max(id), 0), ifnull((
+                               SELECT seq FROM sqlite_sequence WHERE name = ?
+                           ), 0)) FROM {0};'''.format(fieldname), (fieldname,))
+            self.next_id[fieldname] = cur.fetchone()[0] + 1
+            self.added[fieldname] = []
+            self.delta[fieldname] = {}
+    def encode(self, fieldname: str, value: str) -> int:
+        """ get id of type and count one occurrence, None when type is blank or a reference """
+        if (not value) or ("見" in value):
+            return None
+        type_id = self.ids[fieldname].get(value)
+        if type_id is None:
+            type_id = self.next_id[fieldname]
+            self.next_id[fieldname] += 1
+            self.ids[fieldname][value] = type_id
+            self.added[fieldname].append((type_id, value))
+        delta = self.delta[fieldname]
+        delta[type_id] = delta.get(type_id, 0) + 1
+        return type_id
+    def discount(self, fieldname: str, type_id: int, count: int = 1):
+        """ take back occurrences of type, e.g. of rows about to be replaced """
+        delta = self.delta[fieldname]
+        delta[type_id] = delta.get(type_id, 0) - count
+    def flush(self, cur: sqlite3.Cursor):
+        """ write new types and count deltas into lookup tables """
+        for fieldname in LOOKUP_FIELDS:
+            cur.executemany("INSERT INTO {0}(id, type) VALUES (?, ?);".format(fieldname),
+                            self.added[fieldname])
+            cur.executemany("UPDATE {0} SET count = count + ? WHERE id = ?;".format(fieldname),
+                            [(count, type_id) for type_id, count in self.delta[fieldname].items()])
+            self.added[fieldname].clear()
+            self.delta[fieldname].clear()
+
+def statements(prefix: str, unified: bool = False,
+               deal: settings.Deal = settings.Deal.sold) -> dict:
+    """ prepare insert statements of data tables of a deal type with the same prefix """
+    # unified tables take quarter as literal, so parameters are the same in both schemas
+    quarter = quote(prefix) + ", " if unified else ""
+    return {
+        "TRX": '''INSERT INTO {0} VALUES (
+                     {1}?, ?, ?, ?, ?, ?, ?, ?, ?
+                 );'''.format(table_name(prefix, "TRX", unified, deal), quarter),
+        "GEO": '''INSERT INTO {0}({1}編號) VALUES ({2}?);'''.format(
+            table_name(prefix, "GEO", unified, deal), "quarter, " if unified else "", quarter),
+        "BUILD": '''INSERT INTO {0} VALUES (
+                       {1}?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+                   );'''.format(table_name(prefix, "BUILD", unified, deal), quarter),
+        "LAND": '''INSERT INTO {0} VALUES ({1}?, ?, ?, ?, ?);'''.format(
+            table_name(prefix, "LAND", unified, deal), quarter),
+        "PARK": '''INSERT INTO {0} VALUES ({1}?, ?, ?, ?);'''.format(
+            table_name(prefix, "PARK", unified, deal), quarter)
+    }
+
+def normalize_row(row: dict, county: str, lookup: LookupCache) -> dict:
+    """ convert csv row into parameters of each data table, None if row is not a building """
+    if "建物" not in row["交易標的"]:
+        return None
+
+    if row["鄉鎮市區"] == "fa72埔鄉":
+        row["鄉鎮市區"] = "鹽埔鄉"
+    elif row["鄉鎮市區"] == "金fa4b鄉":
+        row["鄉鎮市區"] = "金峰鄉"
+    numbers = floor_all([f for f in row["移轉層次"].split(sep="，") if f and f[-1] == "層"])
+    num_str = ", ".join(str(number) for number in numbers)
+    return {
+        "TRX": (row["編號"], county, row["鄉鎮市區"], row["土地區段位置或建物區門牌"],
+                row["交易年月日"], row["總價元"], row["單價每平方公尺"],
+                True if ("親" in row["備註"]) or ("友" in row["備註"]) else False,
+                True if "增建" in row["備註"] else False),
+        "GEO": (row["編號"],),
+        "BUILD": (row["編號"], floor(row["總樓層數"]), num_str if num_str else None,
+                  lookup.encode("建物型態", row["建物型態"]),
+                  lookup.encode("主要用途", row["主要用途"]),
+                  lookup.encode("主要建材", row["主要建材"]),
+                  row["建築完成年月"], row["建物移轉總面積平方公尺"],
+                  True if row["建物現況格局-隔間"] == "有" else False, row["建物現況格局-房"],
+                  row["建物現況格局-廳"], row["建物現況格局-衛"],
+                  True if row["有無管理組織"] == "有" else False),
+        "LAND": (row["編號"], row["土地移轉總面積平方公尺"],
+                 lookup.encode("都市土地使用分區", row["都市土地使用分區"]),
+                 lookup.encode("非都市土地使用分區", row["非都市土地使用分區"]),
+                 lookup.encode("非都市土地使用編定", row["非都市土地使用編定"])),
+        "PARK": (row["編號"], lookup.encode("車位類別", row["車位類別"]),
+                 row["車位移轉總面積平方公尺"], row["車位總價元"])
+    }
+
+def parse_csv(rdr: csv.DictReader, cur: sqlite3.Cursor, prefix: str, county: str,
+              lookup: LookupCache, sql: dict = None) -> int:
+    """ insert csv into specified data table row by row """
+    sql = sql if sql else statements(prefix)
+    count = 0
     for row in rdr:
-        if "建物" not in row["交易標的"]:
+        values = normalize_row(row, county, lookup)
+        if values is None:
             continue
-
-        if row["鄉鎮市區"] == "fa72埔鄉":
-            row["鄉鎮市區"] = "鹽埔鄉"
-        elif row["鄉鎮市區"] == "金fa4b鄉":
-            row["鄉鎮市區"] = "金峰鄉"
         try:
-            cur.execute('''INSERT INTO "{0}/TRX" VALUES (
-                               ?, ?, ?, ?, ?, ?, ?, ?, ?
-                           );'''.format(prefix),
-                        (row["編號"], county, row["鄉鎮市區"], row["土地區段位置或建物區門牌"],
-                         row["交易年月日"], row["總價元"], row["單價每平方公尺"],
-                         True if ("親" in row["備註"]) or ("友" in row["備註"]) else False,
-                         True if "增建" in row["備註"] else False))
+            cur.execute(sql["TRX"], values["TRX"])
         except sqlite3.IntegrityError:
             pprint.pprint(row)
             raise
-        numbers = floor_all([f for f in row["移轉層次"].split(sep="，") if f and f[-1] == "層"])
-        num_str = ", ".join(str(number) for number in numbers)
-
-        cur.execute('''INSERT INTO "{0}/GEO"(編號) VALUES (?);'''.format(prefix), (row["編號"],))
-
-        exist_row(row, "建物型態")
-        exist_row(row, "主要用途")
-        exist_row(row, "主要建材")
-        cur.execute('''INSERT INTO "{0}/BUILD" VALUES (
-                           ?, ?, ?, (
-                               SELECT id FROM 建物型態 WHERE type == ?
-                           ), (
-                               SELECT id FROM 主要用途 WHERE type == ?
-                           ), (
-                               SELECT id FROM 主要建材 WHERE type == ?
-                           ), ?, ?, ?, ?, ?, ?, ?
-                       );'''.format(prefix),
-                    (row["編號"], floor(row["總樓層數"]), num_str if num_str else None, row["建物型態"],
-                     row["主要用途"], row["主要建材"], row["建築完成年月"], row["建物移轉總面積平方公尺"],
-                     True if row["建物現況格局-隔間"] == "有" else False, row["建物現況格局-房"], row["建物現況格局-廳"],
-                     row["建物現況格局-衛"], True if row["有無管理組織"] == "有" else False))
-
-        exist_row(row, "都市土地使用分區")
-        exist_row(row, "非都市土地使用分區")
-        exist_row(row, "非都市土地使用編定")
-        cur.execute('''INSERT INTO "{0}/LAND" VALUES (
-                           ?, ?, (
-                               SELECT id FROM 都市土地使用分區 WHERE type == ?
-                           ), (
-                               SELECT id FROM 非都市土地使用分區 WHERE type == ?
-                           ), (
-                               SELECT id FROM 非都市土地使用編定 WHERE type == ?
-                           )
-                       );'''.format(prefix),
-                    (row["編號"], row["土地移轉總面積平方公尺"], row["都市土地使用分區"], row["非都市土地使用分區"],
-                     row["非都市土地使用編定"]))
-
-        exist_row(row, "車位類別")
-        cur.execute('''INSERT INTO "{0}/PARK" VALUES (
-                           ?, (
-                               SELECT id FROM 車位類別 WHERE type == ?
-                           ), ?, ?
-                       );'''.format(prefix),
-                    (row["編號"], row["車位類別"], row["車位移轉總面積平方公尺"], row["車位總價元"]))
-
-def main():
-    """ Main Process """
-    connection = sqlite3.connect(settings.__main_db__)
-    cursor = connection.cursor()
-    table_names = init_db(cursor)
+        cur.execute(sql["GEO"], values["GEO"])
+        cur.execute(sql["BUILD"], values["BUILD"])
+        cur.execute(sql["LAND"], values["LAND"])
+        cur.execute(sql["PARK"], values["PARK"])
+        count += 1
+    return count
 
-    folder_names = next(os.walk(settings.__resources__))[1]
-    for folder_name in folder_names:
-        print(folder_name)
-        folder_path = os.path.join(settings.__resources__, folder_name)
-        if folder_name in table_names:
+def flush_batch(cur: sqlite3.Cursor, sql: dict, buffers: dict, rows: list):
+    """ write buffered parameters with executemany, then empty the buffers """
+    cur.execute("SAVEPOINT batch;")
+    try:
+        for table, params in buffers.items():
+            cur.executemany(sql[table], params)
+    except sqlite3.IntegrityError:
+        # replay the batch row by row to locate the offending row
+        cur.execute("ROLLBACK TO batch;")
+        for row, params in zip(rows, buffers["TRX"]):
+            try:
+                cur.execute(sql["TRX"], params)
+            except sqlite3.IntegrityError:
+                pprint.pprint(row)
+                raise
+        raise
+    cur.execute("RELEASE batch;")
+    for params in buffers.values():
+        params.clear()
+    rows.clear()
+
+def parse_csv_batched(rdr: csv.DictReader, cur: sqlite3.Cursor, prefix: str, county: str,
+                      lookup: LookupCache, sql: dict = None, batch_size: int = BATCH_SIZE) -> int:
+    """ insert csv into specified data table, flushing every batch_size rows """
+    sql = sql if sql else statements(prefix)
+    buffers = {table: [] for table in sql}
+    rows = []
+    count = 0
+    for row in rdr:
+        values = normalize_row(row, county, lookup)
+        if values is None:
             continue
-        cursor.execute("BEGIN;") # Disable auto-commit
-        create_table(cursor, folder_name)
-        file_names = os.listdir(folder_path)
-        for file_name in file_names:
-            (root, ext) = os.path.splitext(file_name)
-            if (ext != ".CSV") or (not root.endswith("A")):
-                continue
-            file_path = os.path.join(folder_path, file_name)
+        for table, params in buffers.items():
+            params.append(values[table])
+        rows.append(row)
+        count += 1
+        if len(rows) >= batch_size:
+            flush_batch(cur, sql, buffers, rows)
+    if rows:
+        flush_batch(cur, sql, buffers, rows)
+    return count
+
+def season_sources() -> list:
+    """ list (season, path) of extracted season folders and zipped season archives """
+    (_, folder_names, file_names) = next(os.walk(settings.__resources__))
+    sources = [(folder_name, os.path.join(settings.__resources__, folder_name))
+               for folder_name in folder_names]
+    for file_name in file_names:
+        (root, ext) = os.path.splitext(file_name)
+        if ext.lower() == ".zip" and root not in folder_names:
+            sources.append((root, os.path.join(settings.__resources__, file_name)))
+    return sources
+
+def csv_names(source_path: str) -> list:
+    """ list names of sold, presold and rent csv files in season folder or zip archive """
+    if os.path.isdir(source_path):
+        names = os.listdir(source_path)
+    else:
+        with ZipFile(source_path) as zipped_file:
+            names = zipped_file.namelist()
+    deal_names = []
+    for name in names:
+        (root, ext) = os.path.splitext(os.path.basename(name))
+        if (ext == ".CSV") and root.endswith(tuple(str(deal) for deal in settings.Deal)):
+            deal_names.append(name)
+    return deal_names
+def deal_of(name: str) -> settings.Deal:
+    """ get deal type of csv file from the last letter of its name """
+    return settings.Deal(os.path.splitext(os.path.basename(name))[0][-1])
+def deal_reader(fstream, deal: settings.Deal = settings.Deal.sold) -> csv.DictReader:
+    """ read csv file of a deal type with the column names of sold records """
+    rdr = csv.DictReader(fstream, restval="")
+    if deal is not settings.Deal.sold:
+        aliases = DEAL_ALIASES.get(deal, {})
+        fieldnames = [aliases.get(fieldname, fieldname) for fieldname in rdr.fieldnames]
+        # columns a deal type does not publish read as blank
+        rdr.fieldnames = fieldnames + [fieldname for fieldname in SOLD_FIELDS
+                                       if fieldname not in fieldnames]
+    return rdr
+
+def file_state(source_path: str, name: str) -> tuple:
+    """ get (size, modified time) of csv file without reading it """
+    if os.path.isdir(source_path):
+        stat = os.stat(os.path.join(source_path, name))
+        return (stat.st_size, repr(stat.st_mtime))
+    with ZipFile(source_path) as zipped_file:
+        info = zipped_file.getinfo(name)
+        return (info.file_size, "%04d-%02d-%02d %02d:%02d:%02d" %(info.date_time))
+
+def file_digest(source_path: str, name: str) -> str:
+    """ get sha1 checksum of csv file content """
+    sha1 = hashlib.sha1()
+    if os.path.isdir(source_path):
+        with open(os.path.join(source_path, name), 'rb') as bstream:
+            for chunk in iter(lambda: bstream.read(1 << 20), b""):
+                sha1.update(chunk)
+    else:
+        with ZipFile(source_path) as zipped_file, zipped_file.open(name) as bstream:
+            for chunk in iter(lambda: bstream.read(1 << 20), b""):
+                sha1.update(chunk)
+    return sha1.hexdigest()
+
+def open_csv(source_path: str, names: list = None):
+    """ yield (name, root, text stream) of sold csv files in season folder or zip archive """
+    names = names if names is not None else csv_names(source_path)
+    if os.path.isdir(source_path):
+        for name in names:
+            root = os.path.splitext(name)[0]
+            file_path = os.path.join(source_path, name)
             with open(file_path, 'r', encoding='big5', errors='ignore') as fstream:
-                reader = csv.DictReader(fstream)
-                cnty_cht = settings.alpha2cht(root[0])
-                parse_csv(reader, cursor, folder_name, cnty_cht)
-        cursor.execute('''INSERT INTO {0}(quarter, createdAt) VALUES (
-                              ?, CURRENT_TIMESTAMP
-                          );'''.format(IMPORTED_FOLDERS),
-                       (folder_name,))
-        connection.commit()
+                yield (name, root, fstream)
+        return
+    # stream members out of archive without extracting them
+    with ZipFile(source_path) as zipped_file:
+        for name in names:
+            root = os.path.splitext(os.path.basename(name))[0]
+            with zipped_file.open(name) as bstream, \
+                 io.TextIOWrapper(bstream, encoding='big5', errors='ignore') as fstream:
+                yield (name, root, fstream)
+
+def record_file(cur: sqlite3.Cursor, folder_name: str, source_path: str, name: str,
+                row_count: int, digest: str = None):
+    """ remember checksum and row count of imported csv file """
+    (size, modified) = file_state(source_path, name)
+    cur.execute('''INSERT OR REPLACE INTO {0} VALUES (
+                       ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP
+                   );'''.format(IMPORTED_FILES),
+                (folder_name, name, size, modified,
+                 digest if digest else file_digest(source_path, name), row_count))
+
+def import_folder(cur: sqlite3.Cursor, folder_name: str, source_path: str,
+                  lookup: LookupCache, batch_size: int = BATCH_SIZE, unified: bool = False) -> int:
+    """ create data tables of a season and insert its csv files of every deal type in one pass """
+    row_count = 0
+    create_table(cur, folder_name, unified)
+    deal_sql = {settings.Deal.sold: statements(folder_name, unified)}
+    for (name, root, fstream) in open_csv(source_path):
+        deal = deal_of(name)
+        if deal not in deal_sql:
+            create_table(cur, folder_name, unified, deal)
+            deal_sql[deal] = statements(folder_name, unified, deal)
+        sql = deal_sql[deal]
+        reader = deal_reader(fstream, deal)
+        cnty_cht = settings.alpha2cht(root[0])
+        if batch_size > 0:
+            file_rows = parse_csv_batched(reader, cur, folder_name, cnty_cht,
+                                          lookup, sql, batch_size)
+        else:
+            file_rows = parse_csv(reader, cur, folder_name, cnty_cht, lookup, sql)
+        record_file(cur, folder_name, source_path, name, file_rows)
+        row_count += file_rows
+    lookup.flush(cur)
+    record_keys(cur, folder_name)
+    return row_count
+
+def upsert_csv(rdr: csv.DictReader, cur: sqlite3.Cursor, prefix: str, county: str,
+               lookup: LookupCache, unified: bool = False,
+               deal: settings.Deal = settings.Deal.sold) -> tuple:
+    """ bring rows of a county up to date with its csv file, return (rows, affected rows) """
+    # per-quarter tables, or views of them in unified schema
+    quarter_tables = {name: table_name(prefix, name, False, deal) for name in DATA_TABLES}
+    # stage the file in temporary tables shaped like the quarter's tables
+    for name in ("TRX", "BUILD", "LAND", "PARK"):
+        cur.execute('DROP TABLE IF EXISTS temp."staged/{0}";'.format(name))
+        cur.execute('CREATE TEMP TABLE "staged/{0}" AS SELECT * FROM {1} WHERE 0;'.format(
+            name, quarter_tables[name]))
+    sql = statements("staged")
+    buffers = {"TRX": [], "BUILD": [], "LAND": [], "PARK": []}
+    for row in rdr:
+        values = normalize_row(row, county, lookup)
+        if values is None:
+            continue
+        for table, params in buffers.items():
+            params.append(values[table])
+    for table, params in buffers.items():
+        cur.executemany(sql[table], params)
+
+    # rows that are new or differ in any table, and rows no longer published
+    cur.execute('DROP TABLE IF EXISTS temp."staged/existing";')
+    cur.execute('''CREATE TEMP TABLE "staged/existing" AS
+                   SELECT 編號, 土地區段位置或建物區門牌 FROM {0} WHERE 縣市 == ?;'''.format(
+                       quarter_tables["TRX"]),
+                (county,))
+    cur.execute('DROP TABLE IF EXISTS temp."staged/changed";')
+    cur.execute('''CREATE TEMP TABLE "staged/changed" AS
+                   SELECT 編號 FROM (
+                       SELECT * FROM "staged/TRX" EXCEPT SELECT * FROM {0} WHERE 縣市 == ?
+                   ) UNION {1};'''.format(quarter_tables["TRX"], " UNION ".join(
+                       '''SELECT 編號 FROM (
+                              SELECT * FROM "staged/{1}" EXCEPT SELECT * FROM {0}
+                              WHERE 編號 IN (SELECT 編號 FROM "staged/existing")
+                          )'''.format(quarter_tables[name], name) for name in LOOKUP_COLUMNS)),
+                (county,))
+    cur.execute('DROP TABLE IF EXISTS temp."staged/removed";')
+    cur.execute('''CREATE TEMP TABLE "staged/removed" AS
+                   SELECT 編號 FROM "staged/existing" EXCEPT SELECT 編號 FROM "staged/TRX";''')
+
+    # every staged row was counted, so take back the counts of rows already stored
+    for (name, fieldnames) in LOOKUP_COLUMNS.items():
+        for fieldname in fieldnames:
+            cur.execute('''SELECT {1}, count(*) FROM {0}
+                           WHERE 編號 IN (SELECT 編號 FROM "staged/existing") AND {1} IS NOT NULL
+                           GROUP BY {1};'''.format(quarter_tables[name], fieldname))
+            for (type_id, count) in cur.fetchall():
+                lookup.discount(fieldname, type_id, count)
+
+    quarter = quote(prefix) + ", " if unified else ""
+    in_quarter = "quarter == {0} AND ".format(quote(prefix)) if unified else ""
+    for name in ("TRX", "BUILD", "LAND", "PARK"):
+        cur.execute('''DELETE FROM {0} WHERE {1}編號 IN (
+                           SELECT 編號 FROM "staged/changed" UNION SELECT 編號 FROM "staged/removed"
+                       );'''.format(table_name(prefix, name, unified, deal), in_quarter))
+        cur.execute('''INSERT INTO {0} SELECT {1}* FROM "staged/{2}"
+                       WHERE 編號 IN (SELECT 編號 FROM "staged/changed");'''.format(
+                           table_name(prefix, name, unified, deal), quarter, name))
+    # coordinates stay valid unless the address changed
+    geo_table = table_name(prefix, "GEO", unified, deal)
+    cur.execute('''DELETE FROM {0} WHERE {1}編號 IN (SELECT 編號 FROM "staged/removed");'''.format(
+        geo_table, in_quarter))
+    cur.execute('''UPDATE {0} SET
+                       LAT_1 = NULL, LON_1 = NULL, LAT_2 = NULL, LON_2 = NULL,
+                       LAT_3 = NULL, LON_3 = NULL, LAT_4 = NULL, LON_4 = NULL,
+                       LAT_5 = NULL, LON_5 = NULL, LAT_Avg = NULL, LON_Avg = NULL
+                   WHERE {1}編號 IN (
+                       SELECT 編號 FROM "staged/TRX" JOIN "staged/existing" AS e USING(編號)
+                       WHERE "staged/TRX".土地區段位置或建物區門牌 != e.土地區段位置或建物區門牌
+                   );'''.format(geo_table, in_quarter))
+    regeocode = cur.rowcount
+    cur.execute('''INSERT INTO {0}({1}編號) SELECT {2}編號 FROM "staged/changed"
+                   WHERE 編號 NOT IN (SELECT 編號 FROM "staged/existing");'''.format(
+                       geo_table, "quarter, " if unified else "", quarter))
+    regeocode += cur.rowcount
+    if regeocode and deal is settings.Deal.sold:
+        # let address_geocoder visit the county of this quarter again
+        bitmask = 1 << (ord(settings.cht2alpha(county)) - 65)
+        cur.execute("UPDATE {0} SET geocode_log = (geocode_log & ~?) WHERE quarter == ?;".format(
+            IMPORTED_FOLDERS), (bitmask, prefix))
+
+    cur.execute('SELECT (SELECT count(*) FROM "staged/changed") + (SELECT count(*) FROM "staged/removed");')
+    return (len(buffers["TRX"]), cur.fetchone()[0])
+
+def refresh_folder(cur: sqlite3.Cursor, folder_name: str, source_path: str,
+                   lookup: LookupCache, unified: bool = False) -> int:
+    """ re-import csv files of an imported season that are new or changed, return affected rows """
+    cur.execute("SELECT file, size, modifiedAt, sha1 FROM {0} WHERE quarter == ?;".format(
+        IMPORTED_FILES), (folder_name,))
+    recorded = {name: state for (name, *state) in cur.fetchall()}
+    changed_names = []; digests = {}  # init local variable
+    for name in csv_names(source_path):
+        if name in recorded:
+            if tuple(recorded[name][:2]) == file_state(source_path, name):
+                continue
+            digests[name] = file_digest(source_path, name)
+            if digests[name] == recorded[name][2]:
+                # same content written again, remember new state to skip hashing next time
+                cur.execute("UPDATE {0} SET size = ?, modifiedAt = ? WHERE quarter == ? AND file == ?;"
+                            .format(IMPORTED_FILES),
+                            file_state(source_path, name) + (folder_name, name))
+                continue
+        changed_names.append(name)
+
+    affected = 0
+    for deal in set(deal_of(name) for name in changed_names):
+        # deal types first published after the season was imported
+        create_table(cur, folder_name, unified, deal)
+    for (name, root, fstream) in open_csv(source_path, changed_names):
+        deal = deal_of(name)
+        (file_rows, file_affected) = upsert_csv(deal_reader(fstream, deal), cur, folder_name,
+                                                settings.alpha2cht(root[0]), lookup, unified, deal)
+        record_file(cur, folder_name, source_path, name, file_rows, digests.get(name))
+        affected += file_affected
+    lookup.flush(cur)
+    # also keys addresses imported before address keys existed
+    record_keys(cur, folder_name)
+    return affected
+
+def record_keys(cur: sqlite3.Cursor, folder_name: str) -> int:
+    """ store address keys of addresses of a season not seen before, return their number """
+    # addresses naming no county are keyed in the county of their transaction
+    cur.execute('''SELECT DISTINCT 縣市, 土地區段位置或建物區門牌 FROM {0} AS TRX
+                   WHERE NOT EXISTS (SELECT * FROM {1} AS K WHERE K.county = TRX.縣市
+                                     AND K.address = TRX.土地區段位置或建物區門牌);'''.format(
+                       table_name(folder_name, "TRX", False), ADDRESS_KEY))
+    keys = [(county, address, address_key(address, county))
+            for (county, address) in cur.fetchall()]
+    cur.executemany("INSERT INTO {0} VALUES (?, ?, ?);".format(ADDRESS_KEY), keys)
+    return len(keys)
+
+def record_folder(cur: sqlite3.Cursor, folder_name: str):
+    """ mark season folder as imported """
+    cur.execute('''INSERT INTO {0}(quarter, createdAt) VALUES (
+                       ?, CURRENT_TIMESTAMP
+                   );'''.format(IMPORTED_FOLDERS),
+                (folder_name,))
+
+def print_speed(row_count: int, elapsed: float):
+    """ report import speed of a season folder """
+    print("%d rows in %.1f seconds (%.0f rows/sec)"
+          %(row_count, elapsed, row_count / elapsed if elapsed else 0))
+
+def build_staging(task: tuple) -> tuple:
+    """ worker process building one season folder into its own staging database """
+    (folder_name, source_path, staging_path, batch_size, unified, bulk) = task
+    start = time.perf_counter()
+    if os.path.exists(staging_path):
+        os.remove(staging_path)
+    connection = sqlite3.connect(staging_path)
+    cursor = connection.cursor()
+    if bulk:
+        # staging file is rebuilt from scratch after a crash anyway
+        bulk_load(cursor, "off")
+    init_db(cursor, unified)
+    lookup = LookupCache(cursor)
+    cursor.execute("BEGIN;") # Disable auto-commit
+    row_count = import_folder(cursor, folder_name, source_path, lookup, batch_size, unified)
+    connection.commit()
+    if bulk:
+        restore_safe(cursor)
     connection.close()
+    return (folder_name, staging_path, row_count, time.perf_counter() - start)
+
+def merge_staging(con: sqlite3.Connection, cur: sqlite3.Cursor, prefix: str, staging_path: str,
+                  unified: bool = False, indexed: bool = True):
+    """ merge a staging database into main database in one transaction """
+
+    def remap(fieldname: str, column: str) -> str:
+        """ translate lookup id of staging database into lookup id of main database """
+        return '''(SELECT m.id FROM staging.{0} AS s JOIN main.{0} AS m ON m.type = s.type
+                    WHERE s.id = {1})'''.format(fieldname, column)
+
+    def copy(name: str, deal: settings.Deal, columns: str = "*"):
+        """ copy data table of the quarter from staging database """
+        table = table_name(prefix, name, unified, deal)
+        cur.execute("INSERT INTO main.{0} SELECT {1} FROM staging.{0} AS t;".format(
+            table, ("t.quarter, " if unified and columns != "*" else "") + columns))
+
+    cur.execute("ATTACH DATABASE ? AS staging;", (staging_path,))
+    try:
+        cur.execute("BEGIN;") # Disable auto-commit
+        create_table(cur, prefix, unified)
+        cur.execute("SELECT file FROM staging.{0};".format(IMPORTED_FILES))
+        found = set(deal_of(name) for (name,) in cur.fetchall())
+        deals = [deal for deal in settings.Deal if deal in found]
+        for deal in deals:
+            create_table(cur, prefix, unified, deal)
+        for fieldname in LOOKUP_FIELDS:
+            # new types keep their order of first appearance
+            cur.execute('''INSERT INTO main.{0}(type)
+                           SELECT type FROM staging.{0}
+                           WHERE type NOT IN (SELECT type FROM main.{0})
+                           ORDER BY id;'''.format(fieldname))
+            cur.execute('''UPDATE main.{0} SET count = count + (
+                               SELECT s.count FROM staging.{0} AS s WHERE s.type = main.{0}.type
+                           ) WHERE type IN (SELECT type FROM staging.{0});'''.format(fieldname))
+        for deal in deals:
+            copy("TRX", deal)
+            copy("GEO", deal)
+            copy("BUILD", deal, '''t.編號, t.總樓層數, t.移轉層次, {0}, {1}, {2},
+                                   t.建築完成年月, t.建物移轉總面積平方公尺, t."建物現況格局-隔間",
+                                   t."建物現況格局-房", t."建物現況格局-廳", t."建物現況格局-衛",
+                                   t.有無管理組織'''.format(
+                                       remap("建物型態", "t.建物型態"), remap("主要用途", "t.主要用途"),
+                                       remap("主要建材", "t.主要建材")))
+            copy("LAND", deal, "t.編號, t.土地移轉總面積平方公尺, {0}, {1}, {2}".format(
+                remap("都市土地使用分區", "t.都市土地使用分區"),
+                remap("非都市土地使用分區", "t.非都市土地使用分區"),
+                remap("非都市土地使用編定", "t.非都市土地使用編定")))
+            copy("PARK", deal, "t.編號, {0}, t.車位移轉總面積平方公尺, t.車位總價元".format(
+                remap("車位類別", "t.車位類別")))
+        cur.execute("INSERT INTO main.{0} SELECT * FROM staging.{0};".format(IMPORTED_FILES))
+        cur.execute("INSERT OR IGNORE INTO main.{0} SELECT * FROM staging.{0};".format(ADDRESS_KEY))
+        if indexed:
+            create_index(cur, prefix, unified)
+        record_folder(cur, prefix)
+        con.commit()
+    except:
+        con.rollback()
+        raise
+    finally:
+        cur.execute("DETACH DATABASE staging;")
+
+def migrate(con: sqlite3.Connection, cur: sqlite3.Cursor):
+    """ move per-quarter tables into unified tables, one quarter per transaction """
+    if schema_version(cur) == UNIFIED_SCHEMA:
+        print("Database already uses unified schema")
+        return
+    init_db(cur, unified=True)
+    con.commit()
+    while True:
+        start = time.perf_counter()
+        # lock out other writers while a quarter changes hands
+        cur.execute("BEGIN IMMEDIATE;")
+        cur.execute('''SELECT name FROM sqlite_master
+                       WHERE type == 'table' AND name LIKE '%/TRX' LIMIT 1;''')
+        found = cur.fetchone()
+        if not found:
+            create_index(cur, None, unified=True)
+            cur.execute("PRAGMA user_version = {0};".format(UNIFIED_SCHEMA))
+            con.commit()
+            break
+        prefix = found[0][:-len("/TRX")]
+        print(prefix)
+        row_count = 0
+        for deal in settings.Deal:
+            cur.execute("SELECT EXISTS(SELECT * FROM sqlite_master WHERE type == 'table' AND name == ?);",
+                        (table_name(prefix, "TRX", False, deal)[1:-1],))
+            if not cur.fetchone()[0]:
+                continue
+            cur.execute("SELECT count(*) FROM {0};".format(table_name(prefix, "TRX", False, deal)))
+            row_count += cur.fetchone()[0]
+            for name in DATA_TABLES:
+                cur.execute("INSERT INTO {0} SELECT {1}, * FROM {2};".format(
+                    table_name(prefix, name, True, deal), quote(prefix),
+                    table_name(prefix, name, False, deal)))
+            for name in DATA_TABLES[::-1]:
+                cur.execute("DROP TABLE {0};".format(table_name(prefix, name, False, deal)))
+            create_view(cur, prefix, deal)
+        con.commit()
+        print_speed(row_count, time.perf_counter() - start)
+
+def import_all(con: sqlite3.Connection, cur: sqlite3.Cursor, batch_size: int = BATCH_SIZE,
+               jobs: int = 1, defer_index: bool = False, bulk: bool = False):
+    """ refresh imported seasons and import new seasons """
+    unified = schema_version(cur) == UNIFIED_SCHEMA
+    table_names = init_db(cur, unified)
+    if defer_index and unified:
+        # shared indexes would otherwise be maintained on every insert
+        drop_index(cur, None, unified)
+
+    sources = season_sources()
+    new_quarters = [folder_name for (folder_name, _) in sources if folder_name not in table_names]
+    lookup = LookupCache(cur)
+    for (folder_name, source_path) in sources:
+        if folder_name not in table_names:
+            continue
+        print(folder_name)
+        cur.execute("BEGIN;") # Disable auto-commit
+        affected = refresh_folder(cur, folder_name, source_path, lookup, unified)
+        con.commit()
+        if affected:
+            print("%d rows updated from republished files" %(affected))
+    if jobs > 1:
+        tasks = [(folder_name, source_path,
+                  os.path.join(settings.__resources__, folder_name + ".staging.db"),
+                  batch_size, unified, bulk)
+                 for (folder_name, source_path) in sources if folder_name not in table_names]
+        with Pool(jobs) as pool:
+            # merge in folder order so lookup ids match a sequential import
+            for (folder_name, staging_path, row_count, elapsed) in \
+                pool.imap(build_staging, tasks):
+                print(folder_name)
+                merge_staging(con, cur, folder_name, staging_path, unified,
+                              not defer_index)
+                os.remove(staging_path)
+                print_speed(row_count, elapsed)
+    else:
+        for (folder_name, source_path) in sources:
+            if folder_name in table_names:
+                continue
+            print(folder_name)
+            start = time.perf_counter()
+            cur.execute("BEGIN;") # Disable auto-commit
+            row_count = import_folder(cur, folder_name, source_path, lookup, batch_size, unified)
+            if not defer_index:
+                create_index(cur, folder_name, unified)
+            record_folder(cur, folder_name)
+            con.commit()
+            print_speed(row_count, time.perf_counter() - start)
+
+    if defer_index:
+        start = time.perf_counter()
+        for prefix in ([None] if unified else new_quarters):
+            create_index(cur, prefix, unified)
+        print("Indexes built in %.1f seconds" %(time.perf_counter() - start))
+
+def main(batch_size: int = BATCH_SIZE, jobs: int = 1, defer_index: bool = False,
+         bulk: bool = False, durability: str = "normal"):
+    """ Main Process """
+    connection = sqlite3.connect(settings.__main_db__)
+    cursor = connection.cursor()
+    if bulk:
+        bulk_load(cursor, durability)
+    try:
+        import_all(connection, cursor, batch_size, jobs, defer_index, bulk)
+    finally:
+        try:
+            if bulk:
+                # journal mode can not change inside the transaction a failed import left open
+                connection.rollback()
+                restore_safe(cursor)
+        finally:
+            connection.close()
 
 if __name__ == "__main__":
-    main()
+    PARSER = argparse.ArgumentParser(description="create sqlite3 database from csv file")
+    PARSER.add_argument("--batch", type=int, default=BATCH_SIZE, metavar="N",
+                        help="flush inserts with executemany every N rows, 0 inserts row by row")
+    PARSER.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="build N season folders in parallel worker processes")
+    PARSER.add_argument("--migrate", action="store_true",
+                        help="move per-quarter tables into unified tables and exit")
+    PARSER.add_argument("--defer-index", action="store_true",
+                        help="build indexes once after all quarters are loaded")
+    PARSER.add_argument("--reindex", action="store_true",
+                        help="rebuild indexes of all quarters and exit")
+    PARSER.add_argument("--verify-index", action="store_true",
+                        help="check indexes of all quarters and exit")
+    PARSER.add_argument("--bulk", action="store_true",
+                        help="import with WAL, large cache and memory temp store, "
+                             "then restore durable settings")
+    PARSER.add_argument("--durability", choices=DURABILITY, default="normal",
+                        help="synchronous level while --bulk is active (default: normal)")
+    ARGS = PARSER.parse_args()
+    if ARGS.migrate or ARGS.reindex or ARGS.verify_index:
+        CONNECTION = sqlite3.connect(settings.__main_db__)
+        CURSOR = CONNECTION.cursor()
+        if ARGS.migrate:
+            migrate(CONNECTION, CURSOR)
+        UNIFIED = schema_version(CURSOR) == UNIFIED_SCHEMA
+        QUARTERS = init_db(CURSOR, UNIFIED)
+        if ARGS.reindex:
+            rebuild_index(CURSOR, QUARTERS, UNIFIED)
+        if ARGS.verify_index:
+            PROBLEMS = verify_index(CURSOR, QUARTERS, UNIFIED)
+            print("\n".join(PROBLEMS) if PROBLEMS else "All indexes are valid")
+        CONNECTION.close()
+        sys.exit(1 if ARGS.verify_index and PROBLEMS else 0)
+    main(ARGS.batch, ARGS.jobs, ARGS.defer_index, ARGS.bulk, ARGS.durability)
@@ -0,0 +1,36 @@
+"""
+    Build the gazetteer the offline Local geo provider answers from
+"""
+
+__all__ = ["main"]
+
+# Python Standard Library
+import os
+import argparse
+# Third Party Library
+from geo.settings import __config__ as GEO_CONFIG
+from geo.local import GAZETTEER_NAME, build_gazetteer, entries_from_samples, entries_from_csv
+# Dependent Module
+import settings
+
+def main(database: str, csv_paths: list, output: str):
+    """ Main Process """
+    def entries():
+        """ sample points first, so open address data wins on addresses both have """
+        if database and os.path.exists(database):
+            yield from entries_from_samples(database)
+        for csv_path in csv_paths:
+            yield from entries_from_csv(csv_path)
+    print("%d trie nodes written to %s" %(build_gazetteer(entries(), output), output))
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="build gazetteer of the offline geo provider")
+    PARSER.add_argument("--database", default=settings.__main_db__, metavar="DB",
+                        help="database whose SAMPLE_POINTS are included (default: %(default)s)")
+    PARSER.add_argument("--csv", action="append", default=[], metavar="FILE",
+                        help="utf-8 csv of open address data with address, lat and lon columns, "
+                             "may be repeated")
+    PARSER.add_argument("--output", default=os.path.join(GEO_CONFIG, GAZETTEER_NAME),
+                        metavar="FILE", help="gazetteer file (default: %(default)s)")
+    ARGS = PARSER.parse_args()
+    main(ARGS.database, ARGS.csv, ARGS.output)
@@ -4,19 +4,23 @@
 """
 
 __version__ = "0.0.1"
-__all__ = ["geocode"]
-# __all__ = ["geocode", "reverse_geocode"]
+__all__ = ["geocode", "geocode_many", "geocode_batch", "reverse_geocode"]
 
 # Python Standard Library
 import os
 import sys
+import time
+import threading
 from shutil import copyfile
+from multiprocessing.dummy import Pool as ThreadPool
 # Third Party Library
 import yaml
 # Dependent Module
 import geo.dependency as dependency
 from .settings import *
 from .provider import *
+from .cache import GeocodeCache, normalize_query
+from .router import Router
 
 # Restrict this package using Python3 and above only
 if sys.version_info < (3, 0):
@@ -28,41 +32,80 @@ class TryAgainLater(Exception):
         return self.__class__.__name__
 
 PRIORITY_NAME = "priority.yaml"
+JOBS = 16 # requests in flight at once, providers' rate limits still apply
+BATCH_SIZE = 100 # most addresses handed to a provider in one geocode_batch call
 
 __priority__ = os.path.join(__config__, PRIORITY_NAME)
+INIT_LOCK = threading.Lock()
+LAZY_NAMES = ("PRIORITY", "PROVIDERS", "GEOCODE_TIERS", "GEOCODE_INSTANCES",
+              "REVERSE_GEOCODE_INSTANCES", "ROUTER", "CACHE")
+INITIALIZED = False
 
-# load in user defined priority
-try:
-    with open(__priority__, "r") as stream:
-        PRIORITY = yaml.load(stream)
-except:
-    DEFAULT_PRIORITY = os.path.join(__default__, PRIORITY_NAME)
-    copyfile(DEFAULT_PRIORITY, __priority__)
-    open_file(__priority__)
-    raise
-
-# instantiate providers in dependency
-PROVIDERS = {}
-for name in dir(dependency):
-    if "__" not in name:
-        classtype = getattr(dependency, name)
-        if issubclass(classtype, Provider):
-            PROVIDERS[name] = classtype()
-
-# sort provider instances according to prority
-GEOCODE_INSTANCES = []
-for pro_name in PRIORITY["geocode"]:
-    GEOCODE_INSTANCES.append(PROVIDERS[pro_name])
-for key in PROVIDERS:
-    if key not in PRIORITY["geocode"]:
-        GEOCODE_INSTANCES.append(PROVIDERS[key])
-
-# REVERSE_GEOCODE_INSTANCES = []
-# for pro_name in PRIORITY["reverse_geocode"]:
-#     REVERSE_GEOCODE_INSTANCES.append(providers[pro_name])
-# for key in providers:
-#     if key not in PRIORITY["reverse_geocode"]:
-#         REVERSE_GEOCODE_INSTANCES.append(providers[key])
+def init():
+    """ load priority and instantiate providers once, on first use rather than on import """
+    global INITIALIZED
+    with INIT_LOCK:
+        if INITIALIZED:
+            return
+        # load in user defined priority
+        try:
+            with open(__priority__, "r") as stream:
+                priority = yaml.load(stream)
+        except:
+            default_priority = os.path.join(__default__, PRIORITY_NAME)
+            copyfile(default_priority, __priority__)
+            open_file(__priority__)
+            raise
+
+        # instantiate providers in dependency
+        providers = {}
+        for name in dir(dependency):
+            if "__" not in name:
+                classtype = getattr(dependency, name)
+                # offline mode, e.g. for testing, leaves out providers needing network
+                if issubclass(classtype, Provider) and (classtype.offline or not OFFLINE):
+                    providers[name] = classtype()
+
+        # sort provider instances according to prority, a nested list is a tier of equal priority
+        tiers = []
+        for pro_name in priority["geocode"]:
+            tier = pro_name if isinstance(pro_name, list) else [pro_name]
+            tier = [providers[name] for name in tier if name in providers]
+            if tier:
+                tiers.append(tier)
+        # providers missing from an older priority.yaml, offline ones first as they cost nothing
+        listed = [instance for tier in tiers for instance in tier]
+        unlisted = [instance for instance in providers.values() if instance not in listed]
+        tiers = [[instance] for instance in unlisted if instance.offline] + tiers
+        tiers.extend([instance] for instance in unlisted if not instance.offline)
+
+        reverse = [providers[name] for name in priority.get("reverse_geocode") or []
+                   if name in providers]
+        unlisted = [instance for instance in providers.values() if instance not in reverse]
+        reverse = [instance for instance in unlisted if instance.offline] + reverse
+        reverse.extend(instance for instance in unlisted if not instance.offline)
+
+        # names assigned before first use, e.g. a different cache, are kept
+        module = globals()
+        module.setdefault("PRIORITY", priority)
+        module.setdefault("PROVIDERS", providers)
+        module.setdefault("GEOCODE_TIERS", tiers)
+        module.setdefault("GEOCODE_INSTANCES", [instance for tier in tiers for instance in tier])
+        module.setdefault("REVERSE_GEOCODE_INSTANCES", reverse)
+        # providers that keep failing are skipped until a probe finds them healthy again
+        if "ROUTER" not in module:
+            module["ROUTER"] = Router(module["GEOCODE_TIERS"])
+        # results already paid for are answered from local cache
+        if "CACHE" not in module:
+            module["CACHE"] = GeocodeCache()
+        INITIALIZED = True
+
+def __getattr__(name: str):
+    """ initialize package when its providers, router or cache are first looked up """
+    if name in LAZY_NAMES:
+        init()
+        return globals()[name]
+    raise AttributeError("module '%s' has no attribute '%s'" %(__name__, name))
 
 def geocode(address: str, provider:Provider=None, **kwargs):
     """ Integrate geocode service of each provider """
@@ -77,14 +120,38 @@ def geocode(address: str, provider:Provider=None, **kwargs):
         return {"provider": provider.__class__.__name__,
                 "GPS": provider.geocode(address, **kwargs)}
 
-    # greedy attempt using different providers
+    init()
+    query = normalize_query(address, **kwargs)
+    cached = CACHE.get(query)
+    if cached:
+        return cached
+
+    # greedy attempt using different providers, healthiest first within each tier
     error_log = []
-    for instance in GEOCODE_INSTANCES:
+    routed = ROUTER.order()
+    if len(routed) < len(GEOCODE_INSTANCES):
+        # providers behind an open circuit might still recognize address
+        error_log.append(ProviderServerError.__name__)
+    for instance in routed:
         if instance.geocode_available():
+            if not ROUTER.acquire(instance):
+                # another request is probing provider behind an open circuit
+                error_log.append(ProviderServerError.__name__)
+                continue
+            start = time.perf_counter()
             try:
-                return {"provider": instance.__class__.__name__,
-                        "GPS": instance.geocode(address, **kwargs)}
-            except (ProviderOutOfAPIKeys, ProviderServerError, AddressError, CultureError) as error:
+                result = {"provider": instance.__class__.__name__,
+                          "GPS": instance.geocode(address, **kwargs)}
+                ROUTER.record(instance, time.perf_counter() - start)
+                CACHE.put(query, result)
+                return result
+            except (ProviderServerError, ProviderOutOfAPIKeys) as error:
+                ROUTER.record(instance, time.perf_counter() - start, failed=True)
+                error_log.append(error.__class__.__name__)
+                continue
+            except (AddressError, CultureError) as error:
+                # provider answered, which also closes a circuit this request probed
+                ROUTER.record(instance, time.perf_counter() - start)
                 error_log.append(error.__class__.__name__)
                 continue
         else:
@@ -98,6 +165,116 @@ def geocode(address: str, provider:Provider=None, **kwargs):
         raise AddressError(__name__, address)
     raise TryAgainLater
 
-# def reverse_geocode(latitude, longitude):
-#     """ Integrate reverse geocode service of each provider """
-#     raise NotImplementedError
+def geocode_many(addresses: list, jobs: int = JOBS, **kwargs) -> list:
+    """ Geocode addresses concurrently, None in place of addresses no provider recognizes """
+    def attempt(address):
+        """ geocode one address in worker thread """
+        try:
+            return geocode(address, **kwargs)
+        except AddressError:
+            return None
+    if not addresses:
+        return []
+    pool = ThreadPool(min(jobs, len(addresses)))
+    try:
+        # TryAgainLater of any address is raised once every request has returned
+        return pool.map(attempt, addresses)
+    finally:
+        pool.close()
+        pool.join()
+
+def geocode_batch(addresses: list, jobs: int = JOBS, batch_size: int = BATCH_SIZE,
+                  **kwargs) -> list:
+    """ Geocode addresses in batches, providers in priority take over what the previous left """
+    init()
+    results = [None] * len(addresses)
+    queries = [normalize_query(address, **kwargs) for address in addresses]
+    first = {}
+    pending = []
+    for (index, query) in enumerate(queries):
+        if query in first:
+            continue
+        first[query] = index
+        results[index] = CACHE.get(query)
+        if not results[index]:
+            pending.append(index)
+    retry = set()
+    routed = ROUTER.order()
+    if len(routed) < len(GEOCODE_INSTANCES):
+        retry.update(pending)
+    for instance in routed:
+        if not pending:
+            break
+        if not instance.geocode_available():
+            retry.update(pending)
+            continue
+        def submit(batch: list, instance=instance) -> list:
+            """ geocode batch on worker thread, logging health of provider """
+            start = time.perf_counter()
+            answer = instance.geocode_batch([addresses[index] for index in batch], **kwargs)
+            ROUTER.record(instance, (time.perf_counter() - start) / len(batch),
+                          any(isinstance(gps, ProviderServerError) for gps in answer))
+            return answer
+        batches = []
+        answers = []
+        if ROUTER.half_open(instance):
+            # an open circuit is probed with one address, batches wait until it is back fine
+            if not ROUTER.acquire(instance):
+                retry.update(pending)
+                continue
+            batches.append(pending[:1])
+            answers.append(submit(pending[:1]))
+        rest = pending[1:] if batches else pending
+        pending = []
+        if rest and ROUTER.half_open(instance):
+            # probe failed, the rest is left to other providers
+            pending.extend(rest)
+            retry.update(rest)
+        elif rest:
+            # spread addresses over jobs batches, so providers looping over geocode run concurrently
+            size = min(batch_size, -(-len(rest) // jobs))
+            spread = [rest[start:start + size] for start in range(0, len(rest), size)]
+            pool = ThreadPool(len(spread))
+            try:
+                answers.extend(pool.map(submit, spread))
+            finally:
+                pool.close()
+                pool.join()
+            batches.extend(spread)
+        for (batch, answer) in zip(batches, answers):
+            for (index, gps) in zip(batch, answer):
+                if isinstance(gps, Exception):
+                    pending.append(index)
+                    if not isinstance(gps, AddressError):
+                        retry.add(index)
+                    continue
+                results[index] = {"provider": instance.__class__.__name__, "GPS": gps}
+                CACHE.put(queries[index], results[index])
+    # addresses every provider rejected stay None, like in geocode_many
+    if retry.intersection(pending):
+        raise TryAgainLater
+    return [results[first[query]] for query in queries]
+
+def reverse_geocode(latitude: float, longitude: float):
+    """ Integrate reverse geocode service of each provider """
+    init()
+    error_log = []
+    for instance in REVERSE_GEOCODE_INSTANCES:
+        try:
+            if not instance.reverse_geocode_available():
+                error_log.append(ProviderOutOfAPIKeys.__name__)
+                continue
+            return {"provider": instance.__class__.__name__,
+                    "address": instance.reverse_geocode(latitude, longitude)}
+        except NotImplementedError:
+            # provider offers no reverse geocoding
+            continue
+        except (ProviderServerError, ProviderOutOfAPIKeys, AddressError) as error:
+            error_log.append(error.__class__.__name__)
+            continue
+
+    # check if point isn't recognized by any providers
+    for error in error_log:
+        if error != AddressError.__name__:
+            raise TryAgainLater
+    raise AddressError(__name__, "%f, %f" %(latitude, longitude))
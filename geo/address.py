@@ -0,0 +1,76 @@
+"""
+    Canonical form of Taiwanese addresses, so spelling variants of one place share a key.
+"""
+
+__all__ = ["canonical", "parse_address", "address_key"]
+
+# Python Standard Library
+import re
+import unicodedata
+from functools import lru_cache
+from collections import namedtuple
+
+Address = namedtuple("Address",
+                     ["county", "district", "road", "section", "lane", "alley", "number"])
+
+DIGITS_CHT = {"零": 0, "〇": 0, "一": 1, "二": 2, "兩": 2, "三": 3, "四": 4,
+              "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+UNITS_CHT = {"十": 10, "百": 100, "千": 1000}
+# Chinese numerals counting sections, lanes, alleys, numbers and floors, not those naming roads
+NUMERAL_CHT = re.compile(r"(?<=之)[零〇一二兩三四五六七八九十百千]+|"
+                         r"[零〇一二兩三四五六七八九十百千]+(?=[段巷弄號樓層])")
+# counties of settings.CountyCht, and those merged into special municipalities in 2010 and 2014
+COUNTIES = ("臺北市", "臺中市", "基隆市", "臺南市", "高雄市", "新北市", "宜蘭縣", "桃園市",
+            "嘉義市", "新竹縣", "苗栗縣", "南投縣", "彰化縣", "新竹市", "雲林縣", "嘉義縣",
+            "屏東縣", "花蓮縣", "臺東縣", "金門縣", "澎湖縣", "連江縣",
+            "臺北縣", "臺中縣", "臺南縣", "高雄縣", "桃園縣")
+# districts having 鄉, 鎮, 市 or 區 inside their name, where a lazy match would stop too early,
+# followed by the suffix they had before their county was merged
+DISTRICTS = ("平鎮[區市]", "新市[區鄉]", "左鎮[區鄉]")
+ADDRESS = re.compile(r"(?P<county>" + "|".join(COUNTIES) + r")?"
+                     r"(?P<district>" + "|".join(DISTRICTS) + r"|[^縣市鄉鎮區]{1,3}?[鄉鎮市區])?"
+                     r"(?P<road>.*?)"
+                     r"(?:(?P<section>\d+)段)?"
+                     r"(?:(?P<lane>\d+)巷)?"
+                     r"(?:(?P<alley>\d+)弄)?"
+                     r"(?P<number>\d+(?:~\d+)?(?:之\d+)?)號(?P<sub>之\d+)?")
+
+def cht2int(numeral: str) -> int:
+    """ convert Chinese numeral such as 二十三 or 一百零五 into integer """
+    total = 0; digit = 0  # init local variable
+    for char in numeral:
+        if char in UNITS_CHT:
+            total += (digit if digit else 1) * UNITS_CHT[char]
+            digit = 0
+        else:
+            digit = digit * 10 + DIGITS_CHT[char]
+    return total + digit
+
+@lru_cache(maxsize=1 << 16)
+def canonical(address: str) -> str:
+    """ fold width, spacing, 台 into 臺 and Chinese numbers into Arabic digits """
+    address = re.sub(r"\s+", "", unicodedata.normalize("NFKC", address)).replace("台", "臺")
+    return NUMERAL_CHT.sub(lambda found: str(cht2int(found.group(0))), address)
+
+def parse_address(address: str) -> Address:
+    """ split address into its parts, None if it has no door number, e.g. a land lot """
+    found = ADDRESS.match(canonical(address))
+    if not found:
+        return None
+    number = found.group("number")
+    # 12號之3 and 12之3號 are the same door
+    if found.group("sub") and "之" not in number:
+        number += found.group("sub")
+    return Address(found.group("county") or "", found.group("district") or "",
+                   found.group("road"), found.group("section") or "", found.group("lane") or "",
+                   found.group("alley") or "", number)
+
+def address_key(address: str, county: str = "") -> str:
+    """ key shared by variants of an address in county, ignoring anything after the door number """
+    parts = parse_address(address)
+    county = canonical(county)
+    if not parts:
+        address = canonical(address)
+        return address if address.startswith(county) else county + address
+    # districts such as 中正區 exist in more than one county
+    return "|".join(parts._replace(county=parts.county or county))
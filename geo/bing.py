@@ -1,14 +1,13 @@
 """ Manages geo service provided by Bing """
 
 # Python Standard Library
-import os
 import json
-from datetime import datetime
 # Third Party Library
-import yaml
 import requests
 # Dependent Module
 from .settings import *
+from .keypool import KeyPool
+from .ratelimit import TokenBucket
 from .provider import Provider, Placeholder, provider_config_update
 from .provider import ProviderOutOfAPIKeys, ProviderServerError, AddressError, CultureError
 
@@ -22,6 +21,8 @@ class Bing(Provider):
 
         # shortcut for lengthy dictionary access
         self.config_geocode = self.config["service"]["geocode"]
+        self.geocode_keys = KeyPool(self.__yaml__, self.config, "geocode")
+        self.geocode_limit = TokenBucket(**(self.config_geocode.get("rate_limit") or {}))
         # self.config_reverse_geocode = self.config["service"]["reverse_geocode"]
 
         # preparation for reverse geocode method
@@ -30,19 +31,8 @@ class Bing(Provider):
         #     if api_key["key"] and not api_key["expired"]:
         #         self.reverse_geocode_keys.append(api_key)
 
-    @classmethod
-    def geocode_available(cls):
-        filename = os.path.basename(__file__)
-        path = os.path.join(__config__, filename.replace(".py", ".yaml"))
-        with open(path, "r") as stream:
-            config = yaml.load(stream)
-        for api_key in config["service"]["geocode"]["api_keys"]:
-            if not api_key["expired"]:
-                return True
-            elapsed_time = datetime.now() - api_key["expired_time"]
-            if elapsed_time.days > 0:
-                return True
-        return False
+    def geocode_available(self):
+        return self.geocode_keys.available()
 
     @provider_config_update
     def geocode(self, address: str, **kwargs):
@@ -58,21 +48,19 @@ class Bing(Provider):
         # attempt to geocode until no keys are available
         query_path = self.config_geocode["api_path"].replace(str(Placeholder.CULTURE), culture)
         query_path = query_path.replace(str(Placeholder.ADDRESS), address)
-        for api_key in self.config_geocode["api_keys"]:
-            if api_key["expired"]:
-                elapsed_time = datetime.now() - api_key["expired_time"]
-                if elapsed_time.days <= 0:
-                    continue
+        for api_key in self.geocode_keys.usable():
             full_path = query_path.replace(str(Placeholder.API_KEY), api_key["key"])
-            response = json.loads(requests.get(full_path).text)
+            self.geocode_limit.acquire()
+            try:
+                response = json.loads(requests.get(full_path, timeout=REQUEST_TIMEOUT).text)
+            except (requests.RequestException, ValueError):
+                # timeouts and garbled responses count against provider like server errors
+                raise ProviderServerError(self.__class__.__name__)
             statusCode = response["statusCode"]
             if statusCode != 401 and statusCode != 403:
-                api_key["expired"] = False
-                api_key["expired_time"] = None
+                self.geocode_keys.succeeded(api_key)
                 break
-            if not api_key["expired"]:
-                api_key["expired"] = True
-                api_key["expired_time"] = datetime.now()
+            self.geocode_keys.failed(api_key)
         else:
             open_file(self.__yaml__)
             raise ProviderOutOfAPIKeys(self.__class__.__name__)
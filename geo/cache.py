@@ -0,0 +1,118 @@
+"""
+    Persistent cache of geocode results, so the same address is only paid for once.
+"""
+
+__all__ = ["GeocodeCache", "normalize_query"]
+
+# Python Standard Library
+import os
+import time
+import sqlite3
+import threading
+from shutil import copyfile
+# Third Party Library
+import yaml
+# Dependent Module
+from .settings import *
+from .address import address_key
+
+CACHE_NAME = "cache.yaml"
+
+def normalize_query(address: str, **kwargs) -> str:
+    """ cache key of a geocode query, equal for spelling variants of an address """
+    address = address_key(address)
+    options = "&".join("%s=%s" %(key, kwargs[key]) for key in sorted(kwargs))
+    return address + "|" + options if options else address
+
+
+class GeocodeCache(object):
+    """ SQLite backed geocode results with time-to-live and least recently used eviction """
+    def __init__(self, path: str = None, ttl_days: float = None, max_entries: int = None):
+        # load in user defined cache settings
+        config_path = os.path.join(__config__, CACHE_NAME)
+        if not os.path.exists(config_path):
+            copyfile(os.path.join(__default__, CACHE_NAME), config_path)
+        with open(config_path, "r") as stream:
+            config = yaml.safe_load(stream) or {}
+        path = path if path else config.get("path")
+        self.path = path if path else os.path.join(__config__, "cache.db")
+        ttl_days = ttl_days if ttl_days is not None else config.get("ttl_days")
+        self.ttl = ttl_days * 86400 if ttl_days else None
+        self.max_entries = max_entries if max_entries is not None else config.get("max_entries")
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        # losing the last few results on a crash only costs a few repeated queries
+        self.connection.execute("PRAGMA journal_mode = WAL;").fetchone()
+        self.connection.execute("PRAGMA synchronous = NORMAL;")
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS GEOCODE_CACHE(
+                                       query TEXT PRIMARY KEY,
+                                       provider TEXT NOT NULL,
+                                       lat REAL,
+                                       lon REAL,
+                                       createdAt REAL NOT NULL,
+                                       accessedAt REAL NOT NULL
+                                   );''')
+        self.connection.execute('''CREATE INDEX IF NOT EXISTS "GEOCODE_CACHE/accessedAt"
+                                   ON GEOCODE_CACHE(accessedAt);''')
+        self.connection.commit()
+        self.entries = self.connection.execute("SELECT count(*) FROM GEOCODE_CACHE;").fetchone()[0]
+
+    def get(self, query: str) -> dict:
+        """ cached result of normalized query, None if missing or expired """
+        now = time.time()
+        with self.lock:
+            found = self.connection.execute('''SELECT provider, lat, lon, createdAt
+                                               FROM GEOCODE_CACHE WHERE query = ?;''',
+                                            (query,)).fetchone()
+            if found and self.ttl and now - found[3] > self.ttl:
+                self.connection.execute("DELETE FROM GEOCODE_CACHE WHERE query = ?;", (query,))
+                self.connection.commit()
+                self.entries -= 1
+                found = None
+            if not found:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE GEOCODE_CACHE SET accessedAt = ? WHERE query = ?;",
+                                    (now, query))
+            self.connection.commit()
+            self.hits += 1
+        return {"provider": found[0], "GPS": {"lat": found[1], "lon": found[2]}}
+
+    def put(self, query: str, result: dict):
+        """ store result of geocode under normalized query """
+        now = time.time()
+        with self.lock:
+            values = (result["provider"], result["GPS"]["lat"], result["GPS"]["lon"],
+                      now, now, query)
+            cursor = self.connection.execute('''UPDATE GEOCODE_CACHE SET
+                                                  provider = ?, lat = ?, lon = ?,
+                                                  createdAt = ?, accessedAt = ?
+                                              WHERE query = ?;''', values)
+            if not cursor.rowcount:
+                self.connection.execute('''INSERT INTO GEOCODE_CACHE(
+                                               provider, lat, lon, createdAt, accessedAt, query
+                                           ) VALUES (?, ?, ?, ?, ?, ?);''', values)
+                self.entries += 1
+            if self.max_entries and self.entries > self.max_entries:
+                # evict a tenth at once rather than one row per insert
+                evicted = self.entries - self.max_entries * 9 // 10
+                self.connection.execute('''DELETE FROM GEOCODE_CACHE WHERE query IN (
+                                               SELECT query FROM GEOCODE_CACHE
+                                               ORDER BY accessedAt LIMIT ?
+                                           );''', (evicted,))
+                self.entries -= evicted
+            self.connection.commit()
+
+    def stats(self) -> dict:
+        """ hit and miss counters since cache was opened """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": self.entries,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        """ close cache database """
+        with self.lock:
+            self.connection.close()
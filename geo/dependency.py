@@ -2,5 +2,6 @@
     Add or remove providers without influencing __init__.py or causing any potential problems.
 """
 
+from .local import Local
 from .bing import Bing
 from .google import Google
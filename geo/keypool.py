@@ -0,0 +1,118 @@
+"""
+    Keeps expiry state of API keys in memory and writes it back to provider config on change.
+"""
+
+__all__ = ["KeyPool"]
+
+# Python Standard Library
+import os
+import atexit
+import threading
+from datetime import datetime, timedelta
+try:
+    import fcntl
+except ImportError: # Windows, where processes do not share a config folder
+    fcntl = None
+# Third Party Library
+import yaml
+
+COOLDOWN = timedelta(days=1)  # expired keys are tried again after this
+FLUSH_DELAY = 5.0             # seconds of changes written to disk at once
+
+
+class KeyPool(object):
+    """ API keys of one service of a provider, shared by every thread using the provider """
+    def __init__(self, path: str, config: dict, service: str = "geocode",
+                 cooldown: timedelta = COOLDOWN, delay: float = FLUSH_DELAY):
+        self.path = path
+        self.config = config
+        self.service = service
+        self.keys = config["service"][service]["api_keys"]
+        self.cooldown = cooldown
+        self.delay = delay
+        self.lock = threading.RLock()
+        self.dirty = set() # keys changed since last flush
+        self.timer = None
+        self.refresh()
+        atexit.register(self.flush)
+
+    def refresh(self):
+        """ recount usable keys, only needed after key state changes """
+        with self.lock:
+            expired_times = [api_key["expired_time"] for api_key in self.keys
+                             if api_key["expired"] and api_key["expired_time"]]
+            self.active = sum(1 for api_key in self.keys
+                              if not api_key["expired"] or not api_key["expired_time"])
+            self.retry_at = min(expired_times) + self.cooldown if expired_times else None
+
+    def available(self) -> bool:
+        """ check if any key is potentially usable without scanning keys """
+        return bool(self.active) or (self.retry_at is not None and datetime.now() >= self.retry_at)
+
+    def usable(self) -> list:
+        """ list keys worth trying now, in config order """
+        now = datetime.now()
+        with self.lock:
+            return [api_key for api_key in self.keys
+                    if not api_key["expired"] or not api_key["expired_time"]
+                    or now - api_key["expired_time"] >= self.cooldown]
+
+    def succeeded(self, api_key: dict):
+        """ mark key as working again """
+        with self.lock:
+            if api_key["expired"] or api_key["expired_time"] is not None:
+                api_key["expired"] = False
+                api_key["expired_time"] = None
+                self.changed(api_key)
+    def failed(self, api_key: dict):
+        """ mark key as expired, keeping the time it first expired """
+        with self.lock:
+            if not api_key["expired"]:
+                api_key["expired"] = True
+                api_key["expired_time"] = datetime.now()
+                self.changed(api_key)
+    def changed(self, api_key: dict):
+        """ remember key state differs from config file """
+        self.dirty.add(api_key["key"])
+        self.refresh()
+
+    def flush_later(self):
+        """ write config after a short delay, so a burst of changes costs one write """
+        with self.lock:
+            if self.dirty and not self.timer:
+                self.timer = threading.Timer(self.delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+    def flush(self):
+        """ write changed keys into config atomically, keeping changes of other processes """
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            if not self.dirty:
+                return
+            with open(self.path + ".lock", "a") as lock_file:
+                # workers sharing a config folder take turns reading and writing it
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                config = self.config
+                if os.path.exists(self.path):
+                    with open(self.path, "r") as config_in:
+                        config = yaml.safe_load(config_in) or self.config
+                stored = {api_key["key"]: api_key
+                          for api_key in config["service"][self.service]["api_keys"]}
+                for api_key in self.keys:
+                    if api_key["key"] not in stored:
+                        continue
+                    if api_key["key"] in self.dirty:
+                        stored[api_key["key"]]["expired"] = api_key["expired"]
+                        stored[api_key["key"]]["expired_time"] = api_key["expired_time"]
+                    else:
+                        # keys another process found expired or working again
+                        api_key["expired"] = stored[api_key["key"]]["expired"]
+                        api_key["expired_time"] = stored[api_key["key"]]["expired_time"]
+                with open(self.path + ".tmp", "w") as config_out:
+                    yaml.dump(config, config_out)
+                os.replace(self.path + ".tmp", self.path)
+            self.dirty.clear()
+            self.refresh()
@@ -0,0 +1,200 @@
+""" Answers geocode queries offline from a gazetteer of known addresses """
+
+# Python Standard Library
+import os
+import csv
+import mmap
+import struct
+import sqlite3
+import threading
+# Dependent Module
+from .settings import *
+from .address import parse_address
+from .spatial import GridIndex
+from .provider import Provider, AddressError
+
+MAGIC = b"GZT1"
+HEADER = struct.Struct("<4sII")  # magic, node count, offset of root node
+NODE = struct.Struct("<BddI")    # has value, lat, lon, child count
+CHILD = struct.Struct("<IHI")    # offset of label, length of label, offset of child node
+GAZETTEER_NAME = "gazetteer.trie"
+SUFFIXES = ("", "", "", "段", "巷", "弄", "號") # written after each address part
+MAX_DISTANCE = 50.0 # meters reverse geocoding may be off by default
+
+def build_gazetteer(entries, path: str) -> int:
+    """
+        Write (address parts, lat, lon) entries into a flat trie file, return number of nodes.
+        Each level of the trie is one address part, children sorted by label for binary search.
+    """
+    root = [None, {}]
+    for (parts, lat, lon) in entries:
+        node = root
+        for part in parts:
+            node = node[1].setdefault(part.encode("utf-8"), [None, {}])
+        node[0] = (lat, lon)
+
+    # labels first, then nodes in depth-first order, so every offset is known before writing
+    labels = {}; pool = bytearray()  # init local variable
+    nodes = []; stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        for label in node[1]:
+            if label not in labels:
+                labels[label] = HEADER.size + len(pool)
+                pool += label
+        stack.extend(node[1][label] for label in sorted(node[1], reverse=True))
+    offsets = {}; position = HEADER.size + len(pool)
+    for node in nodes:
+        offsets[id(node)] = position
+        position += NODE.size + CHILD.size * len(node[1])
+
+    with open(path + ".tmp", "wb") as stream:
+        stream.write(HEADER.pack(MAGIC, len(nodes), offsets[id(root)]))
+        stream.write(pool)
+        for node in nodes:
+            (lat, lon) = node[0] if node[0] else (0.0, 0.0)
+            stream.write(NODE.pack(1 if node[0] else 0, lat, lon, len(node[1])))
+            for label in sorted(node[1]):
+                stream.write(CHILD.pack(labels[label], len(label), offsets[id(node[1][label])]))
+    os.replace(path + ".tmp", path)
+    return len(nodes)
+
+def entries_from_samples(db_path: str):
+    """ yield gazetteer entries of sample points geocoded by address_geocoder """
+    connection = sqlite3.connect(db_path)
+    try:
+        for (road, number, lat, lon) in connection.execute(
+                "SELECT road, number, lat, lon FROM SAMPLE_POINTS;"):
+            yield (tuple(road.split("|")) + (str(number),), lat, lon)
+    finally:
+        connection.close()
+def entries_from_csv(csv_path: str):
+    """ yield gazetteer entries of open address data with address, lat and lon columns """
+    with open(csv_path, "r", encoding="utf-8", newline="") as stream:
+        for row in csv.DictReader(stream):
+            parts = parse_address(row["address"])
+            if parts:
+                yield (tuple(parts), float(row["lat"]), float(row["lon"]))
+
+
+class Gazetteer(object):
+    """ read-only view of a flat trie file, memory-mapped so opening it costs nothing """
+    def __init__(self, path: str):
+        self.stream = open(path, "rb")
+        self.data = mmap.mmap(self.stream.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.size, self.root) = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError("'%s' is not a gazetteer" %(path))
+
+    def child(self, offset: int, label: bytes) -> int:
+        """ offset of child node under label, None if missing """
+        count = NODE.unpack_from(self.data, offset)[3]
+        base = offset + NODE.size
+        (low, high) = (0, count)
+        while low < high:
+            middle = (low + high) // 2
+            (label_offset, label_size, child_offset) = CHILD.unpack_from(
+                self.data, base + middle * CHILD.size)
+            found = self.data[label_offset:label_offset + label_size]
+            if found == label:
+                return child_offset
+            if found < label:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+    def children(self, offset: int) -> list:
+        """ offsets of all child nodes """
+        count = NODE.unpack_from(self.data, offset)[3]
+        return [CHILD.unpack_from(self.data, offset + NODE.size + index * CHILD.size)[2]
+                for index in range(count)]
+
+    def lookup(self, parts: tuple) -> tuple:
+        """ (lat, lon) of address parts, a missing county or district matches if unambiguous """
+        found = set()
+        frontier = [self.root]
+        for (level, part) in enumerate(parts):
+            label = part.encode("utf-8")
+            if not part and level < 2:
+                # e.g. an address starting at its district matches every county having it
+                frontier = [child for offset in frontier for child in self.children(offset)]
+                continue
+            frontier = [child for child in (self.child(offset, label) for offset in frontier)
+                        if child is not None]
+            if not frontier:
+                return None
+        for offset in frontier:
+            (has_value, lat, lon, _) = NODE.unpack_from(self.data, offset)
+            if has_value:
+                found.add((lat, lon))
+        return found.pop() if len(found) == 1 else None
+
+    def entries(self):
+        """ yield (address parts, lat, lon) of every address in gazetteer """
+        stack = [(self.root, ())]
+        while stack:
+            (offset, parts) = stack.pop()
+            (has_value, lat, lon, count) = NODE.unpack_from(self.data, offset)
+            if has_value:
+                yield (parts, lat, lon)
+            for index in range(count):
+                (label_offset, label_size, child_offset) = CHILD.unpack_from(
+                    self.data, offset + NODE.size + index * CHILD.size)
+                label = self.data[label_offset:label_offset + label_size].decode("utf-8")
+                stack.append((child_offset, parts + (label,)))
+
+    def close(self):
+        """ unmap gazetteer file """
+        self.data.close()
+        self.stream.close()
+
+
+class Local(Provider):
+    """
+        This class inherits from geo.provider.Provider, which gives methods
+        of Local the same paramenters as other geo service providers.
+    """
+    offline = True
+
+    def __init__(self):
+        super(Local, self).__init__(__file__, showPrompt=False, requireConfig=False)
+
+        # shortcut for lengthy dictionary access
+        self.config_geocode = self.config["service"]["geocode"]
+        self.path = self.config_geocode.get("gazetteer") or os.path.join(__config__,
+                                                                         GAZETTEER_NAME)
+        self.gazetteer = Gazetteer(self.path) if os.path.exists(self.path) else None
+        self.config_reverse_geocode = self.config["service"].get("reverse_geocode") or {}
+        self.max_distance = self.config_reverse_geocode.get("max_distance") or MAX_DISTANCE
+        # grid of gazetteer points is built on first reverse geocode
+        self.grid = None
+        self.grid_lock = threading.Lock()
+
+    def geocode_available(self):
+        return self.gazetteer is not None
+
+    def geocode(self, address: str, **kwargs):
+        super(Local, self).geocode(address, **kwargs)
+
+        # misses are left to network providers
+        parts = parse_address(address)
+        found = self.gazetteer.lookup(tuple(parts)) if parts and self.gazetteer else None
+        if not found:
+            raise AddressError(self.__class__.__name__, address)
+        return {"lat": found[0], "lon": found[1]}
+
+    def reverse_geocode_available(self):
+        return self.gazetteer is not None
+
+    def reverse_geocode(self, latitude: float, longitude: float):
+        with self.grid_lock:
+            if self.grid is None:
+                self.grid = GridIndex()
+                for (parts, lat, lon) in self.gazetteer.entries():
+                    self.grid.add(lat, lon, parts)
+        found = self.grid.nearest(latitude, longitude, 1, self.max_distance)
+        if not found:
+            raise AddressError(self.__class__.__name__, "%f, %f" %(latitude, longitude))
+        return "".join(part + suffix for (part, suffix) in zip(found[0][1], SUFFIXES) if part)
+
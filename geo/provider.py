@@ -15,6 +15,7 @@ from enum import Enum, unique
 import yaml
 # Dependent Module
 from .settings import *
+from .keypool import KeyPool
 
 
 class ProviderOutOfAPIKeys(Exception):
@@ -72,21 +73,25 @@ class Provider(object):
     """ Base class for all Geo-providers """
 
     __metaclass__ = abc.ABCMeta
+    offline = False # answers without network, the only kind kept when GEO_OFFLINE is set
 
     def __new__(cls, *args, **kwargs):
         if cls is Provider:
             raise TypeError("Class 'Provider' should not be directly instantiated.")
         return super(Provider, cls).__new__(cls, *args, **kwargs)
 
-    def __init__(self, filepath: str, showPrompt:bool=True):
+    def __init__(self, filepath: str, showPrompt:bool=True, requireConfig:bool=True):
         # load in configuration file for corresponding geo service providers
         filename = os.path.basename(filepath)
         self.__yaml__ = os.path.join(__config__, filename.replace(".py", ".yaml"))
+        blank_config = os.path.join(__default__, filename.replace(".py", ".yaml"))
+        if not requireConfig and not os.path.exists(self.__yaml__):
+            # providers working without keys fall back on their defaults
+            self.__yaml__ = blank_config
         try:
             with open(self.__yaml__, "r") as config_in:
                 self.config = yaml.load(config_in)
         except:
-            blank_config = os.path.join(__default__, filename.replace(".py", ".yaml"))
             copyfile(blank_config, self.__yaml__)
             open_file(self.__yaml__)
             raise
@@ -101,8 +106,8 @@ class Provider(object):
             print("Provider: " + self.__class__.__name__)
             print("Website: " + self.website)
 
-    @abc.abstractclassmethod
-    def geocode_available(cls):
+    @abc.abstractmethod
+    def geocode_available(self):
         """ Checks if geocode service is potentially available. """
         pass
 
@@ -118,6 +123,24 @@ class Provider(object):
             if symbol in address:
                 raise AddressError(self.__class__.__name__, address)
 
+    def geocode_batch(self, addresses: list, **kwargs) -> list:
+        """
+            Get GPS coordinates of many addresses, in the same order.
+            Failed addresses get the exception instead, addresses after ProviderOutOfAPIKeys
+            or ProviderServerError get the same exception and are left to other providers.
+            Loops over geocode unless subclass overrides it with a bulk endpoint.
+        """
+        results = []
+        for address in addresses:
+            try:
+                results.append(self.geocode(address, **kwargs))
+            except (ProviderOutOfAPIKeys, ProviderServerError) as error:
+                results.extend([error] * (len(addresses) - len(results)))
+                break
+            except (AddressError, CultureError) as error:
+                results.append(error)
+        return results
+
     @abc.abstractclassmethod
     def reverse_geocode_available(cls):
         """ Checks if reverse geocode service is potentially available. """
@@ -142,6 +165,8 @@ def provider_config_update(func):
         try:
             return func(self, *args, **kwargs)
         finally:
-            with open(self.__yaml__, "w") as config_out:
-                yaml.dump(self.config, config_out)
+            # key pools only write config once key state changed, and a burst of changes at once
+            for value in vars(self).values():
+                if isinstance(value, KeyPool):
+                    value.flush_later()
     return wrapper
@@ -0,0 +1,34 @@
+"""
+    Token bucket keeping requests of a provider within its quota.
+"""
+
+__all__ = ["TokenBucket"]
+
+# Python Standard Library
+import time
+import threading
+
+
+class TokenBucket(object):
+    """ allows rate requests per second on average and bursts of up to burst requests """
+    def __init__(self, rate: float = None, burst: float = None):
+        self.rate = rate
+        self.burst = burst if burst else max(1.0, rate or 0.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """ take a token, sleeping until it is due, return seconds slept """
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # tokens go negative to reserve future slots, so waiting threads keep arrival order
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
@@ -0,0 +1,101 @@
+"""
+    Orders providers by health, so a failing provider stops slowing down every request.
+"""
+
+__all__ = ["Router"]
+
+# Python Standard Library
+import time
+import threading
+from collections import deque
+
+WINDOW = 50         # latest calls of a provider its error rate and latency are taken from
+MIN_CALLS = 10      # calls needed before error rate may open the circuit
+FAILURE_RATE = 0.5  # error rate opening the circuit
+COOLDOWN = 60.0     # seconds an open circuit waits before letting a probe through
+
+
+class Health(object):
+    """ rolling latency and error rate of a provider, with its circuit breaker """
+    def __init__(self, window: int = WINDOW):
+        self.calls = deque(maxlen=window)
+        self.retry_at = None # set while circuit is open
+
+    def error_rate(self) -> float:
+        """ share of failed calls in window """
+        if not self.calls:
+            return 0.0
+        return sum(1 for (failed, _) in self.calls if failed) / len(self.calls)
+    def latency(self) -> float:
+        """ average seconds of successful calls in window """
+        latencies = [latency for (failed, latency) in self.calls if not failed]
+        return sum(latencies) / len(latencies) if latencies else 0.0
+
+
+class Router(object):
+    """ tiers of providers, reordered within each tier by error rate and latency """
+    def __init__(self, tiers: list, window: int = WINDOW, min_calls: int = MIN_CALLS,
+                 failure_rate: float = FAILURE_RATE, cooldown: float = COOLDOWN):
+        self.tiers = tiers
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.health = {id(instance): Health(window) for tier in tiers for instance in tier}
+        self.lock = threading.Lock()
+
+    def order(self) -> list:
+        """ providers to try in turn, leaving out open circuits still cooling down """
+        now = time.monotonic()
+        routed = []
+        with self.lock:
+            for tier in self.tiers:
+                ranked = sorted(tier, key=lambda instance: (
+                    self.health[id(instance)].error_rate(),
+                    self.health[id(instance)].latency()))
+                for instance in ranked:
+                    retry_at = self.health[id(instance)].retry_at
+                    if retry_at is None or now >= retry_at:
+                        routed.append(instance)
+        return routed
+
+    def half_open(self, instance) -> bool:
+        """ whether circuit of provider is open, so the next request to it is a probe """
+        with self.lock:
+            return self.health[id(instance)].retry_at is not None
+
+    def acquire(self, instance) -> bool:
+        """ whether a request may go to provider now, taking the one probe of an open circuit """
+        now = time.monotonic()
+        with self.lock:
+            health = self.health[id(instance)]
+            if health.retry_at is None:
+                return True
+            if now < health.retry_at:
+                return False
+            # other requests keep away until this probe is back
+            health.retry_at = now + self.cooldown
+            return True
+
+    def record(self, instance, latency: float, failed: bool = False):
+        """ log outcome of a call, opening or closing circuit of provider """
+        with self.lock:
+            health = self.health[id(instance)]
+            if health.retry_at is not None:
+                if failed:
+                    return
+                # probe came back fine
+                health.retry_at = None
+                health.calls.clear()
+            health.calls.append((failed, latency))
+            if (failed and len(health.calls) >= self.min_calls and
+                    health.error_rate() >= self.failure_rate):
+                health.retry_at = time.monotonic() + self.cooldown
+
+    def stats(self) -> dict:
+        """ error rate, latency and circuit state of each provider by class name """
+        with self.lock:
+            return {instance.__class__.__name__: {
+                "error_rate": self.health[id(instance)].error_rate(),
+                "latency": self.health[id(instance)].latency(),
+                "open": self.health[id(instance)].retry_at is not None}
+                    for tier in self.tiers for instance in tier}
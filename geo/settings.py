@@ -2,13 +2,18 @@
     Shared constants and functions accross the "geo" package
 """
 
-__all__ = ["__config__", "__default__", "open_file"]
+__all__ = ["__config__", "__default__", "REQUEST_TIMEOUT", "OFFLINE", "open_file"]
 
 import os
 import sys
 
-__config__ = os.path.abspath(os.path.join(__file__, os.pardir, "config"))
+# workers holding different API keys each point GEO_CONFIG at their own folder
+__config__ = os.path.abspath(os.environ.get("GEO_CONFIG")
+                             or os.path.join(__file__, os.pardir, "config"))
+os.makedirs(__config__, exist_ok=True)
 __default__ = os.path.abspath(os.path.join(__file__, os.pardir, ".geo"))
+REQUEST_TIMEOUT = (5, 15) # seconds to connect, seconds to wait for response of provider
+OFFLINE = bool(os.environ.get("GEO_OFFLINE")) # only providers answering without network
 
 def open_file(path: str):
     """
@@ -0,0 +1,67 @@
+"""
+    Distances and an in-memory grid of points for nearest and radius queries
+"""
+
+__all__ = ["distance", "bounding_box", "GridIndex"]
+
+# Python Standard Library
+import math
+
+EARTH_RADIUS = 6371008.8
+CELL = 0.005 # degrees of latitude and longitude a grid cell spans, about 500 m
+MAX_DISTANCE = 50000.0 # meters nearest searches give up at
+
+def distance(point_a: tuple, point_b: tuple) -> float:
+    """ meters between two (lat, lon) points, close enough within a city """
+    lat = math.radians((point_a[0] + point_b[0]) / 2)
+    d_lat = math.radians(point_b[0] - point_a[0])
+    d_lon = math.radians(point_b[1] - point_a[1]) * math.cos(lat)
+    return EARTH_RADIUS * math.hypot(d_lat, d_lon)
+
+def bounding_box(lat: float, lon: float, radius: float) -> tuple:
+    """ (lowest lat, highest lat, lowest lon, highest lon) enclosing radius meters around point """
+    d_lat = math.degrees(radius / EARTH_RADIUS)
+    d_lon = d_lat / max(math.cos(math.radians(lat)), 1e-6)
+    return (lat - d_lat, lat + d_lat, lon - d_lon, lon + d_lon)
+
+class GridIndex(object):
+    """ points bucketed by grid cell, so queries only look at cells near the point """
+    def __init__(self, cell: float = CELL):
+        self.cell = cell
+        self.cells = {}
+        self.size = 0
+
+    def key(self, lat: float, lon: float) -> tuple:
+        """ grid cell holding point """
+        return (math.floor(lat / self.cell), math.floor(lon / self.cell))
+
+    def add(self, lat: float, lon: float, item):
+        """ index item at point """
+        self.cells.setdefault(self.key(lat, lon), []).append((lat, lon, item))
+        self.size += 1
+
+    def within(self, lat: float, lon: float, radius: float) -> list:
+        """ (meters, item) of points within radius meters, nearest first """
+        (lat_low, lat_high, lon_low, lon_high) = bounding_box(lat, lon, radius)
+        (row_low, col_low) = self.key(lat_low, lon_low)
+        (row_high, col_high) = self.key(lat_high, lon_high)
+        found = []
+        for row in range(row_low, row_high + 1):
+            for col in range(col_low, col_high + 1):
+                for (point_lat, point_lon, item) in self.cells.get((row, col), ()):
+                    meters = distance((lat, lon), (point_lat, point_lon))
+                    if meters <= radius:
+                        found.append((meters, item))
+        found.sort(key=lambda found: found[0])
+        return found
+
+    def nearest(self, lat: float, lon: float, count: int = 1,
+                max_distance: float = MAX_DISTANCE) -> list:
+        """ (meters, item) of the count nearest points within max distance, nearest first """
+        radius = min(self.cell * 111000.0, max_distance)
+        while True:
+            # every point closer than the count-th found lies inside the searched circle
+            found = self.within(lat, lon, radius)
+            if len(found) >= count or radius >= max_distance or len(found) == self.size:
+                return found[:count]
+            radius = min(radius * 2, max_distance)
@@ -0,0 +1,141 @@
+#pylint: disable=C0321
+"""
+    Durable queue of address ranges leased to geocoding workers
+"""
+
+__all__ = ["init_queue", "enqueue", "claim", "extend", "complete", "release", "pending",
+           "Heartbeat"]
+
+# Python Standard Library
+import time
+import sqlite3
+import threading
+
+GEOCODE_QUEUE = "GEOCODE_QUEUE"
+ADDRESS_KEY = "ADDRESS_KEY"
+LEASE = 600.0       # seconds an address range stays with a worker without a heartbeat
+LEASE_SIZE = 200    # address ranges leased at once
+MAX_ATTEMPTS = 5    # leases of an address range before it is left for a person to look at
+
+def init_queue(cur: sqlite3.Cursor):
+    """ create queue table, one row per address key of a quarter and county """
+    cur.execute('''CREATE TABLE IF NOT EXISTS {0}(
+                       id INTEGER PRIMARY KEY,
+                       quarter TEXT NOT NULL,
+                       county TEXT NOT NULL,
+                       key TEXT NOT NULL,
+                       priority INTEGER NOT NULL,
+                       worker TEXT,
+                       lease_until REAL,
+                       attempts INTEGER NOT NULL DEFAULT 0,
+                       done INTEGER NOT NULL DEFAULT 0,
+                       UNIQUE(quarter, county, key)
+                   );'''.format(GEOCODE_QUEUE))
+    cur.execute('''CREATE INDEX IF NOT EXISTS "{0}/todo" ON {0}(priority, quarter, id)
+                   WHERE NOT done;'''.format(GEOCODE_QUEUE))
+
+def enqueue(cur: sqlite3.Cursor, quarter: str, county_cht: str, priority: int) -> int:
+    """ queue address keys of county in quarter still missing coordinates, return count """
+    todo = '''SELECT DISTINCT ifnull(K.key, TRX.土地區段位置或建物區門牌) AS key
+              FROM "{0}/TRX" AS TRX JOIN "{0}/GEO" AS GEO ON TRX.編號 = GEO.編號
+              LEFT JOIN {1} AS K
+              ON K.county = TRX.縣市 AND K.address = TRX.土地區段位置或建物區門牌
+              WHERE TRX.縣市 = ? AND GEO.LAT_Avg ISNULL'''.format(quarter, ADDRESS_KEY)
+    cur.execute('''INSERT OR IGNORE INTO {0}(quarter, county, key, priority)
+                   SELECT ?, ?, key, ? FROM ({1});'''.format(GEOCODE_QUEUE, todo),
+                (quarter, county_cht, priority, county_cht))
+    queued = cur.rowcount
+    # addresses changed by a republished season are geocoded again
+    cur.execute('''UPDATE {0} SET done = 0, worker = NULL, lease_until = NULL, attempts = 0
+                   WHERE quarter = ? AND county = ? AND done AND key IN ({1});'''.format(
+                       GEOCODE_QUEUE, todo), (quarter, county_cht, county_cht))
+    return queued + cur.rowcount
+
+def claim(con: sqlite3.Connection, cur: sqlite3.Cursor, worker: str, size: int = LEASE_SIZE,
+          lease: float = LEASE, county: str = None) -> list:
+    """ lease (id, quarter, county, key) of address ranges no live worker holds, in one county """
+    con.commit()
+    # the write lock is taken before reading, so two workers never lease the same range
+    cur.execute("BEGIN IMMEDIATE;")
+    try:
+        now = time.time()
+        free = "NOT done AND ifnull(lease_until, 0) < ? AND attempts < ?"
+        # workers keep to the county they leased last, else one nobody else is on, where they
+        # interpolate from their own sample points instead of geocoding the same roads side by side
+        cur.execute('''SELECT DISTINCT county FROM {0}
+                       WHERE NOT done AND lease_until >= ? AND worker != ?;'''.format(
+                           GEOCODE_QUEUE), (now, worker))
+        busy = [county for (county,) in cur.fetchall()]
+        cur.execute('''SELECT quarter, county FROM {0} WHERE {1}
+                       ORDER BY county IS NOT ?, county IN ({2}), priority, quarter, id
+                       LIMIT 1;'''.format(GEOCODE_QUEUE, free, ", ".join("?" * len(busy))),
+                    [now, MAX_ATTEMPTS, county] + busy)
+        partition = cur.fetchone()
+        leased = []
+        if partition:
+            cur.execute('''SELECT id, quarter, county, key FROM {0}
+                           WHERE quarter = ? AND county = ? AND {1}
+                           ORDER BY id LIMIT ?;'''.format(GEOCODE_QUEUE, free),
+                        partition + (now, MAX_ATTEMPTS, size))
+            leased = cur.fetchall()
+        cur.executemany('''UPDATE {0} SET worker = ?, lease_until = ?, attempts = attempts + 1
+                           WHERE id = ?;'''.format(GEOCODE_QUEUE),
+                        [(worker, now + lease, row[0]) for row in leased])
+        con.commit()
+    except:
+        con.rollback()
+        raise
+    return leased
+
+def extend(cur: sqlite3.Cursor, worker: str, lease: float = LEASE):
+    """ renew leases of worker, the heartbeat telling others it is still alive """
+    cur.execute('''UPDATE {0} SET lease_until = ?
+                   WHERE worker = ? AND NOT done;'''.format(GEOCODE_QUEUE),
+                (time.time() + lease, worker))
+
+def complete(cur: sqlite3.Cursor, worker: str, ids: list):
+    """ mark leased address ranges geocoded """
+    cur.executemany('''UPDATE {0} SET done = 1, lease_until = NULL
+                       WHERE id = ? AND worker = ?;'''.format(GEOCODE_QUEUE),
+                    [(identity, worker) for identity in ids])
+
+def release(cur: sqlite3.Cursor, worker: str, ids: list):
+    """ hand leased address ranges back untouched, e.g. when providers ran out of quota """
+    cur.executemany('''UPDATE {0} SET worker = NULL, lease_until = NULL, attempts = attempts - 1
+                       WHERE id = ? AND worker = ? AND NOT done;'''.format(GEOCODE_QUEUE),
+                    [(identity, worker) for identity in ids])
+
+def pending(cur: sqlite3.Cursor) -> tuple:
+    """ (address ranges free to lease, address ranges leased by live workers) """
+    cur.execute('''SELECT total(ifnull(lease_until, 0) < ?), total(ifnull(lease_until, 0) >= ?)
+                   FROM {0} WHERE NOT done AND attempts < ?;'''.format(GEOCODE_QUEUE),
+                (time.time(), time.time(), MAX_ATTEMPTS))
+    (free, leased) = cur.fetchone()
+    return (int(free), int(leased))
+
+class Heartbeat(threading.Thread):
+    """ renew leases of worker on its own connection while the worker geocodes """
+    def __init__(self, database: str, worker: str, lease: float = LEASE, timeout: float = LEASE):
+        super(Heartbeat, self).__init__(daemon=True)
+        self.database = database
+        self.worker = worker
+        self.lease = lease
+        self.timeout = timeout
+        self.stopped = threading.Event()
+
+    def run(self):
+        connection = sqlite3.connect(self.database, timeout=self.timeout,
+                                     isolation_level="IMMEDIATE")
+        cursor = connection.cursor()
+        try:
+            # three beats per lease, so one delayed by a busy database does not lose it
+            while not self.stopped.wait(self.lease / 3):
+                extend(cursor, self.worker, self.lease)
+                connection.commit()
+        finally:
+            connection.close()
+
+    def stop(self):
+        """ stop renewing, leases left expire on their own """
+        self.stopped.set()
+        self.join()
@@ -0,0 +1,233 @@
+#pylint: disable=C0321
+"""
+    Crawl, import and geocode seasons in overlapping stages
+"""
+
+# Standard Library
+import sys
+import time
+import queue
+import sqlite3
+import argparse
+import threading
+from multiprocessing.dummy import Pool as ThreadPool
+# Dependent Module
+import geo
+import settings
+import crawler
+import db_creator
+import address_geocoder
+
+QUEUE_SIZE = 2       # downloaded seasons waiting for import
+BUSY_TIMEOUT = 600   # seconds a stage waits for the other stage's write transaction
+GEOCODE_COMMIT = address_geocoder.ADDRESS_BATCH # address ranges geocoded between commits
+DONE = None          # end of stream marker
+
+class Pipeline(object):
+    """ download, import and geocode stages connected by bounded queues """
+    def __init__(self, crawl: crawler.Crawler, keep_zip: bool = False, recheck: bool = False,
+                 batch_size: int = db_creator.BATCH_SIZE, queue_size: int = QUEUE_SIZE,
+                 geocoding: bool = True):
+        self.crawl = crawl
+        self.keep_zip = keep_zip
+        self.recheck = recheck
+        self.batch_size = batch_size
+        self.geocoding = geocoding
+        self.downloaded = queue.Queue(queue_size)
+        self.imported = queue.Queue()
+        self.stop = threading.Event()
+        self.errors = []
+        self.busy = {"download": 0.0, "import": 0.0, "geocode": 0.0}
+        self.busy_lock = threading.Lock()
+
+    def put(self, stage_queue: queue.Queue, item) -> bool:
+        """ put item into queue unless pipeline stops meanwhile """
+        while not self.stop.is_set():
+            try:
+                stage_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    def get(self, stage_queue: queue.Queue):
+        """ get item from queue, DONE when pipeline stops meanwhile """
+        while not self.stop.is_set():
+            try:
+                return stage_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+        return DONE
+    def stage(self, name: str, func):
+        """ run stage, stopping every other stage when it fails """
+        try:
+            func()
+        except Exception as error:
+            print("\n%s stage failed: %s" %(name, error), file=sys.stderr)
+            self.errors.append(error)
+            self.stop.set()
+
+    def download_stage(self):
+        """ download missing seasons, passing each on as soon as it completes """
+        try:
+            # seasons downloaded by an earlier run but never imported go first
+            connection = sqlite3.connect(settings.__main_db__, timeout=BUSY_TIMEOUT)
+            quarters = db_creator.init_db(connection.cursor())
+            connection.close()
+            for (season, _) in db_creator.season_sources():
+                if season not in quarters and not self.put(self.downloaded, season):
+                    return
+            seasons = self.crawl.update_check(self.recheck)
+            if not seasons:
+                return
+            print("%s %d files\n" %("Checking" if self.recheck else "Missing", len(seasons)))
+            pool = ThreadPool(min(self.crawl.jobs, len(seasons)))
+            try:
+                for season in pool.imap_unordered(self.download, seasons):
+                    if season and not self.put(self.downloaded, season):
+                        return
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            self.put(self.downloaded, DONE)
+    def download(self, season: str) -> str:
+        """ download a season, None if it failed """
+        start = time.perf_counter()
+        try:
+            self.crawl.downloader(season, self.keep_zip)
+        except Exception as error:
+            # other seasons are worth importing anyway
+            print("\n%s download failed: %s" %(season, error), file=sys.stderr)
+            return None
+        finally:
+            with self.busy_lock:
+                self.busy["download"] += time.perf_counter() - start
+        return season
+
+    def import_stage(self):
+        """ import each downloaded season in its own transaction """
+        connection = sqlite3.connect(settings.__main_db__, timeout=BUSY_TIMEOUT)
+        cursor = connection.cursor()
+        try:
+            unified = db_creator.schema_version(cursor) == db_creator.UNIFIED_SCHEMA
+            quarters = db_creator.init_db(cursor, unified)
+            connection.commit()
+            lookup = db_creator.LookupCache(cursor)
+            while True:
+                season = self.get(self.downloaded)
+                if season is DONE:
+                    break
+                source_path = dict(db_creator.season_sources()).get(season)
+                if not source_path:
+                    continue
+                start = time.perf_counter()
+                # write lock taken up front, waiting for a geocode commit instead of failing
+                # on a snapshot the geocode stage moved on from
+                cursor.execute("BEGIN IMMEDIATE;")
+                if season in quarters:
+                    # republished season found by --recheck
+                    row_count = db_creator.refresh_folder(cursor, season, source_path, lookup,
+                                                          unified)
+                else:
+                    row_count = db_creator.import_folder(cursor, season, source_path, lookup,
+                                                         self.batch_size, unified)
+                    db_creator.create_index(cursor, season, unified)
+                    db_creator.record_folder(cursor, season)
+                    quarters.append(season)
+                connection.commit()
+                elapsed = time.perf_counter() - start
+                with self.busy_lock:
+                    self.busy["import"] += elapsed
+                print("\n%s imported" %(season))
+                db_creator.print_speed(row_count, elapsed)
+                self.put(self.imported, season)
+        finally:
+            self.put(self.imported, DONE)
+            connection.close()
+
+    def geocode_stage(self):
+        """ geocode pending partitions, picking up quarters as soon as they are imported """
+        connection = sqlite3.connect(settings.__main_db__, timeout=BUSY_TIMEOUT)
+        cursor = connection.cursor()
+        finished = False
+        try:
+            while not self.stop.is_set():
+                # imported seasons only wake this stage up, pending work is read from database
+                while not self.imported.empty():
+                    finished = (self.imported.get() is DONE) or finished
+                partitions = address_geocoder.pending_partitions(cursor)
+                if partitions:
+                    start = time.perf_counter()
+                    # short transactions, so imports of new seasons never wait long
+                    address_geocoder.county_geocode(connection, cursor, *partitions[0],
+                                                    commit_interval=GEOCODE_COMMIT)
+                    with self.busy_lock:
+                        self.busy["geocode"] += time.perf_counter() - start
+                elif finished:
+                    break
+                else:
+                    finished = self.get(self.imported) is DONE
+        except geo.TryAgainLater:
+            # quota used up, downloads and imports carry on regardless
+            print("\nGeocoding paused until providers are available again", file=sys.stderr)
+        finally:
+            connection.close()
+            address_geocoder.print_cache_stats()
+
+    def run(self):
+        """ run all stages until every season is imported and geocoded """
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self.stage, args=("download", self.download_stage)),
+                   threading.Thread(target=self.stage, args=("import", self.import_stage))]
+        if self.geocoding:
+            threads.append(threading.Thread(target=self.stage,
+                                            args=("geocode", self.geocode_stage)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print("\nFinished in %.1f seconds (busy %s)" %(time.perf_counter() - start, ", ".join(
+            "%s %.1fs" %(name, elapsed) for (name, elapsed) in self.busy.items())))
+        if self.errors:
+            raise self.errors[0]
+
+def main(keep_zip: bool = False, recheck: bool = False, batch_size: int = db_creator.BATCH_SIZE,
+         queue_size: int = QUEUE_SIZE, geocoding: bool = True, crawl: crawler.Crawler = None):
+    """ Main Process """
+    crawl = crawl if crawl else crawler.Crawler()
+    connection = sqlite3.connect(settings.__main_db__)
+    cursor = connection.cursor()
+    # every stage finds the bookkeeping tables from the start
+    db_creator.init_db(cursor, db_creator.schema_version(cursor) == db_creator.UNIFIED_SCHEMA)
+    # readers keep going while another stage holds the write lock
+    cursor.execute("PRAGMA journal_mode = WAL;")
+    cursor.close()
+    connection.close()
+    try:
+        Pipeline(crawl, keep_zip, recheck, batch_size, queue_size, geocoding).run()
+    finally:
+        crawl.close()
+        connection = sqlite3.connect(settings.__main_db__)
+        cursor = connection.cursor()
+        db_creator.restore_safe(cursor)
+        cursor.close()
+        connection.close()
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(
+        description="crawl, import and geocode seasons in overlapping stages")
+    PARSER.add_argument("--keep-zip", action="store_true",
+                        help="keep compressed season archives instead of extracting csv files")
+    PARSER.add_argument("--recheck", action="store_true",
+                        help="revalidate downloaded seasons and re-import republished files")
+    PARSER.add_argument("--jobs", type=int, default=crawler.JOBS, metavar="N",
+                        help="download at most N seasons at once (default: %(default)s)")
+    PARSER.add_argument("--batch", type=int, default=db_creator.BATCH_SIZE, metavar="N",
+                        help="flush inserts with executemany every N rows")
+    PARSER.add_argument("--queue", type=int, default=QUEUE_SIZE, metavar="N",
+                        help="downloaded seasons allowed to wait for import (default: %(default)s)")
+    PARSER.add_argument("--no-geocode", action="store_true",
+                        help="only download and import")
+    ARGS = PARSER.parse_args()
+    main(ARGS.keep_zip, ARGS.recheck, ARGS.batch, ARGS.queue, not ARGS.no_geocode,
+         crawler.Crawler(ARGS.jobs))
@@ -0,0 +1,116 @@
+#pylint: disable=C0321
+"""
+    House-number index of geocoded sample points, interpolating coordinates along a road
+"""
+
+__all__ = ["SampleIndex", "road_number"]
+
+# Python Standard Library
+import bisect
+import sqlite3
+# Dependent Module
+from geo.address import canonical, parse_address
+from geo.spatial import distance
+
+SAMPLE_POINTS = "SAMPLE_POINTS"
+MAX_GAP = 40        # widest span of door numbers interpolated across
+MAX_ERROR = 30.0    # meters of estimated interpolation error accepted
+
+def interpolate(number_a: int, point_a: tuple, number_b: int, point_b: tuple,
+                number: int) -> tuple:
+    """ (lat, lon) of number on the straight line between two known door numbers """
+    ratio = (number - number_a) / (number_b - number_a)
+    return (point_a[0] + (point_b[0] - point_a[0]) * ratio,
+            point_a[1] + (point_b[1] - point_a[1]) * ratio)
+
+def road_number(address: str, county: str = "") -> tuple:
+    """ (road key, door number) of address in county, None if it has no plain door number """
+    parts = parse_address(address)
+    if not parts or not parts.number.isdigit():
+        return None
+    # districts such as 中正區 exist in more than one county
+    parts = parts._replace(county=parts.county or canonical(county))
+    return ("|".join(parts[:-1]), int(parts.number))
+
+class SampleIndex(object):
+    """ sample points of each road sorted by door number, loaded from database on demand """
+    def __init__(self, cur: sqlite3.Cursor, max_gap: int = MAX_GAP, max_error: float = MAX_ERROR):
+        self.cur = cur
+        self.max_gap = max_gap
+        self.max_error = max_error
+        self.roads = {}
+        self.added = []
+        cur.execute('''SELECT EXISTS(
+                           SELECT * FROM sqlite_master WHERE type == 'table' AND name == ?
+                       );''', (SAMPLE_POINTS,))
+        self.created = not cur.fetchone()[0]
+        cur.execute('''CREATE TABLE IF NOT EXISTS {0}(
+                           road TEXT NOT NULL,
+                           number INTEGER NOT NULL,
+                           lat REAL NOT NULL,
+                           lon REAL NOT NULL,
+                           PRIMARY KEY(road, number)
+                       );'''.format(SAMPLE_POINTS))
+
+    def road(self, road: str) -> tuple:
+        """ (sorted door numbers, their points) of road """
+        if road not in self.roads:
+            self.cur.execute("SELECT number, lat, lon FROM {0} WHERE road = ? ORDER BY number;"
+                             .format(SAMPLE_POINTS), (road,))
+            rows = self.cur.fetchall()
+            self.roads[road] = ([number for (number, _, _) in rows],
+                                [(lat, lon) for (_, lat, lon) in rows])
+        return self.roads[road]
+
+    def error(self, numbers: list, points: list, at: int) -> float:
+        """ estimated meters off when interpolating between numbers at-1 and at """
+        (left, right) = (at - 1, at)
+        # predict each neighbor from the points around it and see how far off it lands
+        residuals = []
+        if left > 0:
+            predicted = interpolate(numbers[left - 1], points[left - 1],
+                                    numbers[right], points[right], numbers[left])
+            residuals.append(distance(points[left], predicted))
+        if right + 1 < len(numbers):
+            predicted = interpolate(numbers[left], points[left],
+                                    numbers[right + 1], points[right + 1], numbers[right])
+            residuals.append(distance(points[right], predicted))
+        # with nothing to check against, half the way between neighbors is the worst case
+        return max(residuals) if residuals else distance(points[left], points[right]) / 2
+
+    def lookup(self, address: str, county: str = "") -> dict:
+        """ known or interpolated GPS coordinates of address, None if it needs geocoding """
+        found = road_number(address, county)
+        if not found:
+            return None
+        (numbers, points) = self.road(found[0])
+        number = found[1]
+        at = bisect.bisect_left(numbers, number)
+        if at < len(numbers) and numbers[at] == number:
+            return {"lat": points[at][0], "lon": points[at][1]}
+        # never extrapolate past either end of what is known
+        if at == 0 or at == len(numbers) or numbers[at] - numbers[at - 1] > self.max_gap:
+            return None
+        if self.error(numbers, points, at) > self.max_error:
+            return None
+        (lat, lon) = interpolate(numbers[at - 1], points[at - 1], numbers[at], points[at], number)
+        return {"lat": lat, "lon": lon}
+
+    def add(self, address: str, county: str, lat: float, lon: float):
+        """ remember geocoded sample point, written to database on flush """
+        found = road_number(address, county)
+        if not found:
+            return
+        (numbers, points) = self.road(found[0])
+        at = bisect.bisect_left(numbers, found[1])
+        if at < len(numbers) and numbers[at] == found[1]:
+            points[at] = (lat, lon)
+        else:
+            numbers.insert(at, found[1])
+            points.insert(at, (lat, lon))
+        self.added.append(found + (lat, lon))
+    def flush(self):
+        """ write sample points added since last flush """
+        self.cur.executemany("INSERT OR REPLACE INTO {0} VALUES (?, ?, ?, ?);".format(
+            SAMPLE_POINTS), self.added)
+        self.added.clear()
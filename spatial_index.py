@@ -0,0 +1,173 @@
+#pylint: disable=C0321
+"""
+    R*Tree index of geocoded transactions answering nearest and radius queries
+"""
+
+__all__ = ["SpatialIndex"]
+
+# Python Standard Library
+import time
+import sqlite3
+import argparse
+# Third Party Library
+from geo.spatial import distance, bounding_box
+# Dependent Module
+import settings
+from db_creator import deal_table, quote
+
+GEO_POINTS = "GEO_POINTS"   # (source, 編號) of every indexed row, its id keys the R*Tree
+GEO_RTREE = "GEO_RTREE"
+GEO_TABLES = tuple(deal_table("GEO", deal) for deal in settings.Deal)
+RADIUS = 100.0              # meters first searched around a point for its nearest neighbors
+MAX_DISTANCE = 50000.0      # meters nearest searches give up at
+
+class SpatialIndex(object):
+    """
+        LAT_Avg and LON_Avg of every GEO table in an R*Tree, kept up to date by triggers,
+        so rows geocoded later are found without rebuilding the index.
+    """
+    def __init__(self, cur: sqlite3.Cursor):
+        self.cur = cur
+        # R*Tree keeps 32-bit boxes, exact coordinates stay beside them for distances
+        cur.execute('''CREATE TABLE IF NOT EXISTS {0}(
+                           id INTEGER PRIMARY KEY,
+                           source TEXT NOT NULL,
+                           編號 TEXT NOT NULL,
+                           lat REAL,
+                           lon REAL,
+                           UNIQUE(source, 編號)
+                       );'''.format(GEO_POINTS))
+        cur.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS {0}
+                       USING rtree(id, min_lat, max_lat, min_lon, max_lon);'''.format(GEO_RTREE))
+        self.sync()
+
+    def sync(self) -> int:
+        """ attach triggers to GEO tables that lack them and index their rows, return tables """
+        self.cur.execute("SELECT name FROM sqlite_master WHERE type == 'table';")
+        tables = [name for (name,) in self.cur.fetchall()
+                  if name.split("/")[-1] in GEO_TABLES]
+        self.cur.execute("SELECT name FROM sqlite_master WHERE type == 'trigger';")
+        triggers = set(name for (name,) in self.cur.fetchall())
+        attached = 0
+        for table in tables:
+            if table + "/SPATIAL_UPDATE" not in triggers:
+                self.attach(table)
+                attached += 1
+        return attached
+
+    @staticmethod
+    def source(table: str, row: str) -> str:
+        """ sql expression naming the per-quarter table or view a row of table belongs to """
+        if "/" in table:
+            return quote(table)
+        # unified tables hold every quarter, rows are named after the view of their quarter
+        return "{0}.quarter || '/' || {1}".format(row, quote(table))
+
+    def attach(self, table: str):
+        """ index rows of table geocoded so far and follow later changes through triggers """
+        sql = {"table": table, "points": GEO_POINTS, "rtree": GEO_RTREE}
+        self.cur.execute('''INSERT OR REPLACE INTO {points}(id, source, 編號, lat, lon)
+                            SELECT P.id, {source}, T.編號, T.LAT_Avg, T.LON_Avg
+                            FROM "{table}" AS T LEFT JOIN {points} AS P
+                            ON P.source == {source} AND P.編號 == T.編號
+                            WHERE T.LAT_Avg NOTNULL AND T.LON_Avg NOTNULL;'''.format(
+                                source=self.source(table, "T"), **sql))
+        self.cur.execute('''INSERT OR REPLACE INTO {rtree}
+                            SELECT P.id, P.lat, P.lat, P.lon, P.lon
+                            FROM "{table}" AS T JOIN {points} AS P
+                            ON P.source == {source} AND P.編號 == T.編號
+                            WHERE T.LAT_Avg NOTNULL AND T.LON_Avg NOTNULL;'''.format(
+                                source=self.source(table, "T"), **sql))
+        self.cur.execute('''CREATE TRIGGER IF NOT EXISTS "{table}/SPATIAL_UPDATE"
+                            AFTER UPDATE OF LAT_Avg, LON_Avg ON "{table}"
+                            BEGIN
+                                INSERT OR IGNORE INTO {points}(source, 編號)
+                                SELECT {source}, NEW.編號
+                                WHERE NEW.LAT_Avg NOTNULL AND NEW.LON_Avg NOTNULL;
+                                UPDATE {points} SET lat = NEW.LAT_Avg, lon = NEW.LON_Avg
+                                WHERE source == {source} AND 編號 == NEW.編號;
+                                DELETE FROM {rtree} WHERE id == (
+                                    SELECT id FROM {points} WHERE source == {source}
+                                    AND 編號 == NEW.編號
+                                );
+                                INSERT INTO {rtree}
+                                SELECT id, lat, lat, lon, lon FROM {points}
+                                WHERE source == {source} AND 編號 == NEW.編號
+                                AND lat NOTNULL AND lon NOTNULL;
+                            END;'''.format(source=self.source(table, "NEW"), **sql))
+        self.cur.execute('''CREATE TRIGGER IF NOT EXISTS "{table}/SPATIAL_DELETE"
+                            AFTER DELETE ON "{table}"
+                            BEGIN
+                                DELETE FROM {rtree} WHERE id == (
+                                    SELECT id FROM {points} WHERE source == {source}
+                                    AND 編號 == OLD.編號
+                                );
+                                DELETE FROM {points} WHERE source == {source}
+                                AND 編號 == OLD.編號;
+                            END;'''.format(source=self.source(table, "OLD"), **sql))
+
+    def within(self, lat: float, lon: float, radius: float) -> list:
+        """ (meters, source, 編號, lat, lon) of transactions within radius meters, nearest first """
+        self.cur.execute('''SELECT P.source, P.編號, P.lat, P.lon
+                            FROM {0} AS R JOIN {1} AS P USING(id)
+                            WHERE R.max_lat >= ? AND R.min_lat <= ?
+                            AND R.max_lon >= ? AND R.min_lon <= ?;'''.format(
+                                GEO_RTREE, GEO_POINTS), bounding_box(lat, lon, radius))
+        found = []
+        for (source, identity, point_lat, point_lon) in self.cur.fetchall():
+            meters = distance((lat, lon), (point_lat, point_lon))
+            if meters <= radius:
+                found.append((meters, source, identity, point_lat, point_lon))
+        found.sort()
+        return found
+
+    def nearest(self, lat: float, lon: float, count: int = 1,
+                max_distance: float = MAX_DISTANCE) -> list:
+        """ (meters, source, 編號, lat, lon) of the count nearest transactions, nearest first """
+        radius = min(RADIUS, max_distance)
+        while True:
+            # every transaction closer than the count-th found lies inside the searched circle
+            found = self.within(lat, lon, radius)
+            if len(found) >= count or radius >= max_distance:
+                return found[:count]
+            radius = min(radius * 4, max_distance)
+
+def describe(cur: sqlite3.Cursor, found: list) -> list:
+    """ add address and total price of each transaction found """
+    described = []
+    for (meters, source, identity, lat, lon) in found:
+        (quarter, table) = source.split("/")
+        cur.execute('''SELECT 土地區段位置或建物區門牌, 總價元 FROM "{0}/{1}"
+                       WHERE 編號 == ?;'''.format(quarter, table.replace("GEO", "TRX")),
+                    (identity,))
+        row = cur.fetchone()
+        if row:
+            described.append((meters, quarter, identity, lat, lon) + row)
+    return described
+
+def main(lat: float, lon: float, radius: float, count: int):
+    """ Main Process """
+    connection = sqlite3.connect(settings.__main_db__)
+    cursor = connection.cursor()
+    start = time.perf_counter()
+    index = SpatialIndex(cursor)
+    connection.commit()
+    print("Index ready in %.3f seconds" %(time.perf_counter() - start))
+    start = time.perf_counter()
+    found = index.within(lat, lon, radius) if radius else index.nearest(lat, lon, count)
+    elapsed = time.perf_counter() - start
+    for (meters, quarter, identity, _, _, address, price) in describe(cursor, found):
+        print("%7.1f m  %s %s  %s  %d" %(meters, quarter, identity, address, price))
+    print("%d transactions found in %.1f ms" %(len(found), elapsed * 1000))
+    connection.close()
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="find geocoded transactions near a point")
+    PARSER.add_argument("lat", type=float, help="latitude of point")
+    PARSER.add_argument("lon", type=float, help="longitude of point")
+    PARSER.add_argument("--radius", type=float, metavar="METERS",
+                        help="list every transaction within radius instead of the nearest")
+    PARSER.add_argument("--count", type=int, default=10, metavar="N",
+                        help="nearest transactions listed (default: %(default)s)")
+    ARGS = PARSER.parse_args()
+    main(ARGS.lat, ARGS.lon, ARGS.radius, ARGS.count)
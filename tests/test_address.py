@@ -0,0 +1,52 @@
+""" Tests of geo.address splitting addresses into their parts """
+
+# Python Standard Library
+import unittest
+# Dependent Module
+from geo.address import parse_address, address_key
+
+class ParseAddressTest(unittest.TestCase):
+    """ county and district names ending where Taiwanese addresses end them """
+    def test_district_with_suffix_inside(self):
+        parts = parse_address("桃園市平鎮區中豐路100號")
+        self.assertEqual((parts.county, parts.district, parts.road), ("桃園市", "平鎮區", "中豐路"))
+        parts = parse_address("台南市新市區中興街5號")
+        self.assertEqual((parts.county, parts.district, parts.road), ("臺南市", "新市區", "中興街"))
+        parts = parse_address("臺南市左鎮區睦光里3號")
+        self.assertEqual((parts.district, parts.road), ("左鎮區", "睦光里"))
+        parts = parse_address("桃園縣平鎮市中豐路100號")
+        self.assertEqual((parts.county, parts.district, parts.road), ("桃園縣", "平鎮市", "中豐路"))
+
+    def test_county_administered_city(self):
+        parts = parse_address("竹北市光明一路二段12號")
+        self.assertEqual((parts.county, parts.district, parts.road), ("", "竹北市", "光明一路"))
+        self.assertEqual(parts.section, "2")
+        parts = parse_address("新竹縣竹北市光明一路12號")
+        self.assertEqual((parts.county, parts.district), ("新竹縣", "竹北市"))
+        for (address, district) in (("苗栗縣頭份市中華路1號", "頭份市"),
+                                    ("彰化縣員林市中山路一段2號", "員林市"),
+                                    ("澎湖縣馬公市中正路3號", "馬公市")):
+            self.assertEqual(parse_address(address).district, district)
+
+    def test_road_starting_with_suffix(self):
+        self.assertEqual(parse_address("臺北市信義區市府路1號").road, "市府路")
+        self.assertEqual(parse_address("嘉義市東區東門路5號").district, "東區")
+
+    def test_variants_share_key(self):
+        self.assertEqual(address_key("臺北市大安區和平東路二段100巷3弄5號之1"),
+                         address_key("台北市大安區和平東路2段100巷3弄5之1號5樓"))
+
+    def test_key_in_county_of_transaction(self):
+        self.assertEqual(address_key("大安區和平東路二段100號", "臺北市"),
+                         address_key("臺北市大安區和平東路2段100號"))
+        self.assertEqual(address_key("大安區和平東路二段100號", "台北市"),
+                         address_key("臺北市大安區和平東路2段100號", "臺北市"))
+        self.assertNotEqual(address_key("中正區中正路1號", "臺北市"),
+                            address_key("中正區中正路1號", "基隆市"))
+        # county written in the address wins over the county it is filed under
+        self.assertTrue(address_key("新北市板橋區文化路1號", "臺北市").startswith("新北市|"))
+        self.assertEqual(address_key("大安區學府段123地號", "臺北市"),
+                         address_key("臺北市大安區學府段123地號", "臺北市"))
+
+if __name__ == "__main__":
+    unittest.main()